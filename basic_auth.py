@@ -0,0 +1,66 @@
+import hashlib
+import hmac
+import secrets
+import time
+from typing import Optional
+
+from pydantic import BaseModel
+
+from password_hashing import PasswordHasher
+from token_cache import VerifiedTokenCache
+from user_repository import UserRepository
+
+
+class BasicAuthBackend:
+    # Checks HTTP Basic credentials against the hashed passwords of a
+    # UserRepository. API clients send the same credentials with every
+    # request, so a successful check is remembered for cache_ttl seconds as
+    # an HMAC of username and password under a per-process random key:
+    # repeating it costs one HMAC instead of a bcrypt verification, and the
+    # cache never holds anything a stolen memory dump could brute-force
+    # faster than the stored hashes. Failures are never cached.
+    #
+    # Timing: unknown usernames are verified against dummy_hash, so they
+    # take as long as a wrong password; cached digests are compared with
+    # hmac.compare_digest. A cache hit is faster than a miss, but only the
+    # right password can hit, and the response already says that much.
+    def __init__(
+        self,
+        users: UserRepository,
+        hasher: PasswordHasher,
+        dummy_hash: str,
+        cache_ttl: float = 60,
+        max_entries: int = 10000,
+    ):
+        self.users = users
+        self.hasher = hasher
+        self.dummy_hash = dummy_hash
+        self.cache_ttl = cache_ttl
+        self.verifications = 0
+        self._key = secrets.token_bytes(32)
+        # One entry per username, dropped when the user changes.
+        self._verified = VerifiedTokenCache(max_entries=max_entries)
+        users.on_change(self._verified.forget_subject)
+
+    def digest(self, username: str, password: str) -> bytes:
+        message = username.encode() + b"\x00" + password.encode()
+        return hmac.new(self._key, message, hashlib.sha256).digest()
+
+    async def authenticate(self, username: str, password: str) -> Optional[BaseModel]:
+        digest = self.digest(username, password)
+        cached = self._verified.get(username) if self.cache_ttl > 0 else None
+        if cached is not None:
+            cached_digest, user = cached
+            if hmac.compare_digest(cached_digest, digest):
+                return user
+        user = await self.users.get(username)
+        self.verifications += 1
+        hashed_password = user.hashed_password if user is not None else self.dummy_hash
+        if not await self.hasher.verify(password, hashed_password) or user is None:
+            return None
+        if self.cache_ttl > 0:
+            self._verified.put(username, time.time() + self.cache_ttl, username, (digest, user))
+        return user
+
+    def stats(self) -> dict:
+        return {"verifications": self.verifications, "cache": self._verified.stats()}
@@ -0,0 +1,63 @@
+"""Per-request cost of main_oauth2.get_current_user in each token mode.
+
+Calls the dependency directly, without HTTP, so only authentication is
+measured:
+
+    jwt         jwt.decode on every call (token cache bypassed)
+    jwt+cache   repeat tokens served from the verified-token cache
+    opaque      session id looked up in the in-memory session store
+    opaque+shm  session id looked up in a SQLite session store on /dev/shm
+
+    python -m benchmarks.auth_overhead --number 20000
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import main_oauth2
+from session_store import MemorySessionStore, SQLiteSessionStore
+
+
+async def per_call(token: str, number: int) -> float:
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(number):
+            await main_oauth2.get_current_user(token)
+        best = min(best, time.perf_counter() - start)
+    return best / number
+
+
+def main(args):
+    shm = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    path = os.path.join(shm, f"auth_overhead_{os.getpid()}.db")
+    ttl = main_oauth2.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    jwt_token = main_oauth2.create_access_token({"sub": "johndoe"})
+    get_cached = main_oauth2.token_cache.get
+    modes = {
+        "jwt": ("jwt", None, lambda token: None),
+        "jwt+cache": ("jwt", None, get_cached),
+        "opaque": ("opaque", MemorySessionStore(ttl), get_cached),
+        "opaque+shm": ("opaque", SQLiteSessionStore(path, ttl), get_cached),
+    }
+    try:
+        for name, (mode, store, cache_get) in modes.items():
+            main_oauth2.TOKEN_MODE = mode
+            main_oauth2.token_cache.get = cache_get
+            token = store.create("johndoe") if store is not None else jwt_token
+            if store is not None:
+                main_oauth2.sessions = store
+            seconds = asyncio.run(per_call(token, args.number))
+            print(f"{name:<11} {seconds * 1e6:8.2f} us/request")
+    finally:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=20000)
+    main(parser.parse_args())
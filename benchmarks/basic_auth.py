@@ -0,0 +1,33 @@
+"""Requests per second on a Basic-auth endpoint with and without the cache
+of successful credential checks, in-process:
+
+    python -m benchmarks.basic_auth --requests 50
+"""
+import argparse
+import time
+
+from fastapi.testclient import TestClient
+
+import main_oauth_basic
+
+
+def per_second(client: TestClient, requests: int) -> float:
+    start = time.perf_counter()
+    for _ in range(requests):
+        client.get("/users/me", auth=("stanleyjobson", "swordfish")).raise_for_status()
+    return requests / (time.perf_counter() - start)
+
+
+def main(args):
+    with TestClient(main_oauth_basic.app) as client:
+        for name, ttl in (("uncached", 0), ("cached", 60)):
+            main_oauth_basic.basic_auth.cache_ttl = ttl
+            rate = per_second(client, args.requests)
+            print(f"{name:<9} {rate:8.1f} req/s  {1000 / rate:7.2f} ms/req")
+        print(client.get("/auth/stats").json()["basic_auth"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=50)
+    main(parser.parse_args())
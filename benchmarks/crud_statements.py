@@ -0,0 +1,85 @@
+"""Per-call cost of the sql_app.crud read functions, without HTTP.
+
+Compares the prebuilt statements in sql_app.crud against building an ORM
+Query on every call, as crud did before. Each call gets a fresh session, as
+a request would:
+
+    python -m benchmarks.crud_statements --database /tmp/crud_statements.db
+"""
+import argparse
+import os
+import timeit
+
+from sqlalchemy import create_engine, func, insert, select
+from sqlalchemy.orm import sessionmaker
+
+from sql_app import crud, models
+
+
+def populate(engine, users: int):
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        if conn.execute(select(func.count()).select_from(models.User.__table__)).scalar():
+            return
+        conn.execute(
+            insert(models.User.__table__),
+            [{"email": f"user{i}@example.com", "hashed_password": "notreallyhashed"} for i in range(users)],
+        )
+        conn.execute(
+            insert(models.Item.__table__),
+            [{"title": f"Item {i}", "owner_id": i % users + 1} for i in range(users * 2)],
+        )
+
+
+def query_users(db, items=None):
+    query = db.query(models.User)
+    if items is not None:
+        query = query.options(crud.ITEMS_LOADERS[items](models.User.items))
+    return query
+
+
+LEGACY = {
+    "get_user": lambda db: query_users(db).filter(models.User.id == 42).first(),
+    "get_user(selectin)": lambda db: query_users(db, "selectin").filter(models.User.id == 42).first(),
+    "get_user_by_email": lambda db: query_users(db).filter(models.User.email == "user42@example.com").first(),
+    "get_users": lambda db: query_users(db).order_by(models.User.id).offset(100).limit(100).all(),
+    "get_users(selectin)": lambda db: (
+        query_users(db, "selectin").order_by(models.User.id).filter(models.User.id > 100).limit(100).all()
+    ),
+    "get_items": lambda db: db.query(models.Item).order_by(models.Item.id).offset(100).limit(100).all(),
+}
+CURRENT = {
+    "get_user": lambda db: crud.get_user(db, 42),
+    "get_user(selectin)": lambda db: crud.get_user(db, 42, items="selectin"),
+    "get_user_by_email": lambda db: crud.get_user_by_email(db, "user42@example.com"),
+    "get_users": lambda db: crud.get_users(db, skip=100, limit=100),
+    "get_users(selectin)": lambda db: crud.get_users(db, limit=100, after_id=100, items="selectin"),
+    "get_items": lambda db: crud.get_items(db, skip=100, limit=100),
+}
+
+
+def per_call(SessionLocal, fn, number: int) -> float:
+    def call():
+        with SessionLocal() as db:
+            fn(db)
+
+    return min(timeit.repeat(call, number=number, repeat=5)) / number
+
+
+def main(args):
+    engine = create_engine(f"sqlite:///{args.database}")
+    populate(engine, args.users)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    print(f"{'function':<20} {'query us':>9} {'prebuilt us':>12} {'speedup':>8}")
+    for name in LEGACY:
+        legacy = per_call(SessionLocal, LEGACY[name], args.number)
+        current = per_call(SessionLocal, CURRENT[name], args.number)
+        print(f"{name:<20} {legacy * 1e6:>9.1f} {current * 1e6:>12.1f} {legacy / current:>7.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database", default=os.path.join("/tmp", "crud_statements.db"))
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--number", type=int, default=500)
+    main(parser.parse_args())
@@ -0,0 +1,56 @@
+"""Sign and verify throughput of the JWT algorithms jwt_keys supports.
+
+Verification is timed twice: with the key KeyRing parsed once at load time,
+and with the JWK handed to jwt.decode as-is, which parses it on every call
+(what resolve_token did with a raw key before):
+
+    python -m benchmarks.jwt_algorithms --number 2000
+"""
+import argparse
+import os
+import tempfile
+import timeit
+from datetime import datetime, timedelta
+
+from jose import jwt
+
+from jwt_keys import KeyRing, add_key
+
+ALGORITHMS = ["HS256", "RS256", "ES256", "EdDSA"]
+SECRET_KEY = "09d25e094faa6ca2556c818166b7a9563b93f7099f6f0f4caa6cf63b88e8d3e7"
+
+
+def keyring_for(algorithm: str, directory: str):
+    if algorithm.startswith("HS"):
+        return KeyRing(SECRET_KEY, algorithm), SECRET_KEY
+    path = os.path.join(directory, f"{algorithm}.json")
+    public = add_key(path, algorithm)
+    public.pop("d", None)
+    return KeyRing(jwks_path=path), public
+
+
+def per_second(fn, number: int) -> float:
+    return number / min(timeit.repeat(fn, number=number, repeat=5))
+
+
+def main(args):
+    claims = {"sub": "johndoe", "scopes": ["me"], "exp": datetime.utcnow() + timedelta(minutes=30)}
+    directory = tempfile.mkdtemp()
+    print(f"{'algorithm':<10} {'sign/s':>9} {'verify/s':>9} {'reparse/s':>10} {'token bytes':>12}")
+    for algorithm in ALGORITHMS:
+        keyring, raw_key = keyring_for(algorithm, directory)
+        kid, _, signing_key = keyring.signing_key()
+        headers = {"kid": kid} if kid else None
+        token = jwt.encode(claims, signing_key, algorithm=algorithm, headers=headers)
+        _, verification_key = keyring.verification_key(kid)
+
+        sign = per_second(lambda: jwt.encode(claims, signing_key, algorithm=algorithm, headers=headers), args.number)
+        verify = per_second(lambda: jwt.decode(token, verification_key, algorithms=[algorithm]), args.number)
+        reparse = per_second(lambda: jwt.decode(token, raw_key, algorithms=[algorithm]), args.number)
+        print(f"{algorithm:<10} {sign:>9.0f} {verify:>9.0f} {reparse:>10.0f} {len(token):>12}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=2000)
+    main(parser.parse_args())
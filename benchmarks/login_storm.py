@@ -0,0 +1,113 @@
+"""Latency of authenticated non-login requests during a storm of /token logins.
+
+Starts the app under uvicorn, then probes GET /users/me with a valid token,
+first on its own and then while --logins clients log in back to back:
+
+    python -m benchmarks.login_storm --app main_oauth2:app --logins 50
+    python -m benchmarks.login_storm --app main_oauth2_2:app --probe /users/me/ --scope me
+
+Logins rejected by the /token rate limit are counted, not retried; raise
+LOGIN_USERNAME_BURST and LOGIN_IP_BURST to storm the password hasher itself.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+
+def wait_until_up(url: str, timeout: float = 30):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            httpx.get(url + "/docs")
+            return
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+def login_form(args) -> dict:
+    return {"username": "johndoe", "password": "secret", "scope": args.scope}
+
+
+async def probe(client: httpx.AsyncClient, args, headers: dict, deadline: float, latencies):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        response = await client.get(args.probe, headers=headers)
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(args.interval)
+
+
+async def log_in(client: httpx.AsyncClient, args, deadline: float, logins, limited):
+    while time.perf_counter() < deadline:
+        response = await client.post("/token", data=login_form(args))
+        if response.status_code == 429:
+            limited.append(1)
+        else:
+            response.raise_for_status()
+            logins.append(1)
+        await asyncio.sleep(args.login_interval)
+
+
+def report(name: str, latencies, logins: int, limited: int, duration: float):
+    latencies = sorted(latencies)
+    print(
+        f"{name:<8} probes={len(latencies):<5} "
+        f"p50={statistics.median(latencies) * 1000:8.1f}ms "
+        f"p99={latencies[int(len(latencies) * 0.99)] * 1000:8.1f}ms "
+        f"max={latencies[-1] * 1000:8.1f}ms logins/s={logins / duration:6.1f} "
+        f"rate-limited/s={limited / duration:8.1f}"
+    )
+
+
+async def run(args, url: str):
+    limits = httpx.Limits(max_connections=args.logins + 10)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=None) as client:
+        token = (await client.post("/token", data=login_form(args))).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        for name, storm in (("idle", 0), ("storm", args.logins)):
+            latencies, logins, limited = [], [], []
+            deadline = time.perf_counter() + args.duration
+            await asyncio.gather(
+                probe(client, args, headers, deadline, latencies),
+                *[log_in(client, args, deadline, logins, limited) for _ in range(storm)],
+            )
+            report(name, latencies, len(logins), len(limited), args.duration)
+        print((await client.get("/token/stats")).json())
+
+
+def main(args):
+    url = f"http://127.0.0.1:{args.port}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", args.app, "--port", str(args.port), "--log-level", "warning"],
+        cwd=args.app_dir,
+        env={**os.environ, "PYTHONPATH": args.app_dir},
+    )
+    try:
+        wait_until_up(url)
+        asyncio.run(run(args, url))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--app", default="main_oauth2:app")
+    parser.add_argument("--app-dir", default=os.getcwd())
+    parser.add_argument("--probe", default="/users/me")
+    parser.add_argument("--scope", default="")
+    parser.add_argument("--port", type=int, default=8020)
+    parser.add_argument("--logins", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--interval", type=float, default=0.01)
+    # Pause between one storm client's logins. Rejected logins return at
+    # once, so without a pause the clients alone can saturate a small host.
+    parser.add_argument("--login-interval", type=float, default=0)
+    main(parser.parse_args())
@@ -0,0 +1,68 @@
+"""Offset vs keyset pagination cost for sql_app.crud over a large users table.
+
+Builds (once) a SQLite database with --rows users and times fetching one page
+at increasing depths:
+
+    python -m benchmarks.pagination --rows 1000000 --database /tmp/pagination.db
+"""
+import argparse
+import os
+import time
+
+from sqlalchemy import create_engine, func, insert, select
+from sqlalchemy.orm import sessionmaker
+
+from sql_app import crud, models
+
+
+def populate(engine, rows: int):
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        existing = conn.execute(select(func.count()).select_from(models.User.__table__)).scalar()
+        batch = 50000
+        for start in range(existing, rows, batch):
+            conn.execute(
+                insert(models.User.__table__),
+                [
+                    {"email": f"user{i}@example.com", "hashed_password": "notreallyhashed", "is_active": True}
+                    for i in range(start, min(start + batch, rows))
+                ],
+            )
+
+
+def timed(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(args):
+    engine = create_engine(f"sqlite:///{os.path.abspath(args.database)}")
+    populate(engine, args.rows)
+    db = sessionmaker(bind=engine)()
+
+    print(f"{'depth':>10} {'offset ms':>10} {'keyset ms':>10}")
+    depths = []
+    depth = args.limit
+    while depth < args.rows - args.limit:
+        depths.append(depth)
+        depth *= 10
+    depths.append(args.rows - args.limit)
+    for depth in depths:
+        # The keyset query needs the id of the last row of the previous page;
+        # ids are dense here so it is simply the depth.
+        offset = timed(lambda: crud.get_users(db, skip=depth, limit=args.limit), args.repeat)
+        keyset = timed(lambda: crud.get_users(db, limit=args.limit, after_id=depth), args.repeat)
+        print(f"{depth:>10} {offset * 1000:>10.2f} {keyset * 1000:>10.2f}")
+        db.expunge_all()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--database", default="pagination.db")
+    main(parser.parse_args())
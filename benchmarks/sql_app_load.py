@@ -0,0 +1,83 @@
+"""Load test for the sync and async sql_app variants.
+
+Start one of the apps, then point this script at it:
+
+    uvicorn sql_app.main:app --port 8000
+    uvicorn sql_app.async_main:app --port 8001
+
+    python -m benchmarks.sql_app_load --url http://127.0.0.1:8000 --concurrency 500
+    python -m benchmarks.sql_app_load --url http://127.0.0.1:8001 --concurrency 500
+
+The sync app runs every request on the default anyio threadpool (40 threads);
+the async app is bounded by SQLALCHEMY_POOL_SIZE + SQLALCHEMY_MAX_OVERFLOW.
+
+sql_app_peewee serves the same routes, so its connect-per-request and pooled
+modes can be compared the same way:
+
+    PEEWEE_POOL_SIZE=0 uvicorn sql_app_peewee.main:app --port 8002
+    PEEWEE_POOL_SIZE=20 uvicorn sql_app_peewee.main:app --port 8003
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import httpx
+
+
+async def seed(client: httpx.AsyncClient, users: int):
+    response = await client.get("/users/", params={"limit": users})
+    existing = response.json()
+    for i in range(len(existing), users):
+        response = await client.post(
+            "/users/", json={"email": f"load-{i}-{random.random()}@example.com", "password": "secret"}
+        )
+        user_id = response.json()["id"]
+        await client.post(f"/users/{user_id}/items/", json={"title": f"Item {i}", "description": "load"})
+    response = await client.get("/users/", params={"limit": users})
+    return [user["id"] for user in response.json()]
+
+
+async def worker(client: httpx.AsyncClient, user_ids, deadline: float, latencies, errors):
+    while time.perf_counter() < deadline:
+        if random.random() < 0.5:
+            request = client.get(f"/users/{random.choice(user_ids)}")
+        else:
+            request = client.get("/users/", params={"skip": random.randrange(len(user_ids)), "limit": 10})
+        start = time.perf_counter()
+        try:
+            response = await request
+            response.raise_for_status()
+        except httpx.HTTPError:
+            errors.append(1)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+async def main(args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout) as client:
+        user_ids = await seed(client, args.users)
+        latencies, errors = [], []
+        deadline = time.perf_counter() + args.duration
+        await asyncio.gather(
+            *[worker(client, user_ids, deadline, latencies, errors) for _ in range(args.concurrency)]
+        )
+    latencies.sort()
+    print(
+        f"{args.url} concurrency={args.concurrency} requests={len(latencies)} errors={len(errors)} "
+        f"rps={len(latencies) / args.duration:.0f} "
+        f"p50={statistics.median(latencies) * 1000:.1f}ms "
+        f"p99={latencies[int(len(latencies) * 0.99)] * 1000:.1f}ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--timeout", type=float, default=60)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,106 @@
+"""Peak server memory for buffered vs streamed /items/ responses of sql_app.
+
+Builds (once) a SQLite database with --rows items, then starts sql_app.main
+under uvicorn once per mode, downloads every row in one response and reads
+the server's peak RSS (VmHWM, so Linux only):
+
+    python -m benchmarks.streaming --rows 1000000 --database /tmp/streaming.db
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+from sqlalchemy import create_engine, func, insert, select
+
+from sql_app import models
+
+MODES = {
+    "buffered": ({}, {}),
+    "json-stream": ({"stream": "true"}, {}),
+    "ndjson": ({}, {"Accept": "application/x-ndjson"}),
+}
+
+
+def populate(engine, rows: int):
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        if not conn.execute(select(func.count()).select_from(models.User.__table__)).scalar():
+            conn.execute(insert(models.User.__table__), [{"email": "owner@example.com", "hashed_password": "x"}])
+        existing = conn.execute(select(func.count()).select_from(models.Item.__table__)).scalar()
+        batch = 50000
+        for start in range(existing, rows, batch):
+            conn.execute(
+                insert(models.Item.__table__),
+                [
+                    {"title": f"Item {i}", "description": "streamed", "owner_id": 1}
+                    for i in range(start, min(start + batch, rows))
+                ],
+            )
+
+
+def peak_rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    raise RuntimeError("VmHWM not available")
+
+
+def wait_until_up(url: str, timeout: float = 30):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            httpx.get(url + "/docs")
+            return
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+def measure(args, mode: str):
+    params, headers = MODES[mode]
+    url = f"http://127.0.0.1:{args.port}"
+    env = {**os.environ, "SQLALCHEMY_DATABASE_URL": f"sqlite:///{args.database}"}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "sql_app.main:app", "--port", str(args.port), "--log-level", "warning"],
+        env=env,
+    )
+    try:
+        wait_until_up(url)
+        idle = peak_rss_mb(server.pid)
+        start = time.perf_counter()
+        first_byte = None
+        received = 0
+        with httpx.stream(
+            "GET", url + "/items/", params={"limit": args.rows, **params}, headers=headers, timeout=None
+        ) as response:
+            for chunk in response.iter_raw():
+                if first_byte is None:
+                    first_byte = time.perf_counter() - start
+                received += len(chunk)
+        total = time.perf_counter() - start
+        print(
+            f"{mode:<12} idle={idle:7.1f}MB peak={peak_rss_mb(server.pid):7.1f}MB "
+            f"ttfb={first_byte:7.3f}s total={total:7.2f}s body={received / 2 ** 20:6.1f}MB"
+        )
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main(args):
+    populate(create_engine(f"sqlite:///{args.database}"), args.rows)
+    for mode in args.modes:
+        measure(args, mode)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--database", default=os.path.join("/tmp", "streaming.db"))
+    parser.add_argument("--port", type=int, default=8010)
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    main(parser.parse_args())
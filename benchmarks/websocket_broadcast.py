@@ -0,0 +1,115 @@
+"""Broadcast delivery latency of main_websockets.ConnectionManager with simulated clients.
+
+Run from the repository root:
+
+    python -m benchmarks.websocket_broadcast --clients 10000 --slow 100 --stuck 10
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from starlette.websockets import WebSocketState
+
+from main_websockets import TEXT_CODEC, ConnectionManager
+
+
+class Round:
+    def __init__(self, expected: int):
+        self.start = time.perf_counter()
+        self.expected = expected
+        self.latencies = []
+        self.done = asyncio.Event()
+
+    def delivered(self):
+        self.latencies.append(time.perf_counter() - self.start)
+        if len(self.latencies) >= self.expected:
+            self.done.set()
+
+
+class FakeWebSocket:
+    current_round: Round = None
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.client_state = WebSocketState.CONNECTING
+        self.application_state = WebSocketState.CONNECTING
+
+    async def accept(self, subprotocol: str = None):
+        self.client_state = WebSocketState.CONNECTED
+        self.application_state = WebSocketState.CONNECTED
+
+    async def send(self, message: dict):
+        await asyncio.sleep(self.delay)
+        FakeWebSocket.current_round.delivered()
+
+    async def close(self, code: int = 1000, reason: str = None):
+        self.application_state = WebSocketState.DISCONNECTED
+
+
+def make_clients(clients: int, slow: int, stuck: int, slow_delay: float):
+    connections = [FakeWebSocket(0) for _ in range(clients - slow - stuck)]
+    connections += [FakeWebSocket(slow_delay) for _ in range(slow)]
+    connections += [FakeWebSocket(3600) for _ in range(stuck)]
+    return connections
+
+
+async def sequential_broadcast(connections, frame: dict):
+    for connection in connections:
+        await connection.send(frame)
+
+
+async def run_rounds(broadcast, expected: int, rounds: int, timeout: float):
+    latencies = []
+    for i in range(rounds):
+        FakeWebSocket.current_round = Round(expected)
+        await broadcast({"event": "say", "client_id": i, "text": "hello"})
+        try:
+            await asyncio.wait_for(FakeWebSocket.current_round.done.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        latencies += FakeWebSocket.current_round.latencies
+    return latencies
+
+
+def report(name: str, latencies):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(
+        f"{name:<11} deliveries={len(latencies):<8} "
+        f"p50={statistics.median(latencies) * 1000:9.2f}ms "
+        f"p99={p99 * 1000:9.2f}ms "
+        f"max={latencies[-1] * 1000:9.2f}ms"
+    )
+
+
+async def main(args):
+    manager = ConnectionManager(send_timeout=args.timeout, queue_size=args.queue_size)
+    for client_id, websocket in enumerate(make_clients(args.clients, args.slow, args.stuck, args.slow_delay)):
+        await manager.connect(websocket, client_id)
+    latencies = await run_rounds(manager.broadcast, args.clients - args.stuck, args.rounds, args.timeout * 2)
+    report("concurrent", latencies)
+    print(f"{'':<11} connections_left={len(manager.active_connections)}")
+
+    # The sequential loop would hang forever on stuck clients, so they are left out.
+    connections = make_clients(args.clients, args.slow, 0, args.slow_delay)
+    latencies = await run_rounds(
+        lambda message: sequential_broadcast(connections, TEXT_CODEC.encode(message)),
+        args.clients,
+        args.sequential_rounds,
+        args.timeout,
+    )
+    report("sequential", latencies)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=10000)
+    parser.add_argument("--slow", type=int, default=100)
+    parser.add_argument("--stuck", type=int, default=10)
+    parser.add_argument("--slow-delay", type=float, default=0.05)
+    parser.add_argument("--timeout", type=float, default=0.5)
+    parser.add_argument("--queue-size", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=100)
+    parser.add_argument("--sequential-rounds", type=int, default=3)
+    asyncio.run(main(parser.parse_args()))
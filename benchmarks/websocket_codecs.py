@@ -0,0 +1,84 @@
+"""Bytes on the wire and CPU per message for the main_websockets codecs.
+
+Run from the repository root:
+
+    python -m benchmarks.websocket_codecs
+"""
+import argparse
+import random
+import timeit
+
+from main_websockets import CODECS, TEXT_CODEC
+
+WORDS = "the quick brown fox jumps over a lazy dog while chat servers fan out every line".split()
+
+
+def sample_text(length: int) -> str:
+    rng = random.Random(length)
+    words = []
+    while sum(len(word) + 1 for word in words) < length:
+        words.append(rng.choice(WORDS))
+    return " ".join(words)[:length]
+
+
+def wire_size(payload: int) -> int:
+    # Server-to-client frames are unmasked: 2 header bytes, plus 2 or 8 bytes
+    # of extended length for larger payloads.
+    if payload < 126:
+        return payload + 2
+    if payload < 65536:
+        return payload + 4
+    return payload + 10
+
+
+def frame_payload(frame: dict) -> bytes:
+    return frame["bytes"] if "bytes" in frame else frame["text"].encode()
+
+
+def legacy_broadcast(client_id: int, text: str, recipients: int):
+    # What ConnectionManager.broadcast used to do: one f-string, then one
+    # send_text() frame dict per recipient.
+    message = f"Client #{client_id} says: {text}"
+    return [{"type": "websocket.send", "text": message} for _ in range(recipients)]
+
+
+def codec_broadcast(codec, message: dict, recipients: int):
+    frame = codec.encode(message)
+    return [frame for _ in range(recipients)]
+
+
+def main(args):
+    codecs = [TEXT_CODEC] + list(CODECS.values())
+    print(f"{'size':>6} {'codec':<16} {'wire bytes':>10} {'encode us':>10} {'decode us':>10} {'broadcast us':>13}")
+    for size in args.sizes:
+        text = sample_text(size)
+        message = {"event": "say", "client_id": 1234567, "text": text}
+
+        legacy = legacy_broadcast(1234567, text, 1)[0]
+        encode = timeit.timeit(lambda: legacy_broadcast(1234567, text, 1), number=args.number)
+        broadcast = timeit.timeit(lambda: legacy_broadcast(1234567, text, args.recipients), number=args.number // 100)
+        print(
+            f"{size:>6} {'legacy f-string':<16} {wire_size(len(frame_payload(legacy))):>10} "
+            f"{encode / args.number * 1e6:>10.2f} {'':>10} {broadcast / (args.number // 100) * 1e6:>13.1f}"
+        )
+        for codec in codecs:
+            payload = frame_payload(codec.encode(message))
+            encode = timeit.timeit(lambda: codec.encode(message), number=args.number)
+            broadcast = timeit.timeit(lambda: codec_broadcast(codec, message, args.recipients), number=args.number // 100)
+            if codec is TEXT_CODEC:
+                decode = ""
+            else:
+                inbound = codec.pack({"text": text})
+                decode = f"{timeit.timeit(lambda: codec.unpack(inbound), number=args.number) / args.number * 1e6:.2f}"
+            print(
+                f"{'':>6} {codec.name:<16} {wire_size(len(payload)):>10} "
+                f"{encode / args.number * 1e6:>10.2f} {decode:>10} {broadcast / (args.number // 100) * 1e6:>13.1f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[16, 256, 4096])
+    parser.add_argument("--recipients", type=int, default=1000)
+    parser.add_argument("--number", type=int, default=20000)
+    main(parser.parse_args())
@@ -0,0 +1,141 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+
+class MemoryBackend:
+    # Per-process LRU of (expires, value); each worker keeps its own copy.
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value: str, ttl: float):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+
+class SQLiteBackend:
+    # Shared by every worker on the host through one SQLite file (in WAL
+    # mode), so an invalidation in one process is seen by all of them.
+    # Last use is only written back when it is more than touch_interval
+    # seconds old, which keeps hits from turning into writes while still
+    # evicting roughly least recently used entries first.
+    def __init__(self, path: str, max_entries: int = 100000, touch_interval: float = 1.0, evict_every: int = 100):
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+        self.evict_every = evict_every
+        self._sets = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=wal")
+        self._conn.execute("PRAGMA synchronous=off")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires REAL, used REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_used ON cache (used)")
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires, used FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires, used = row
+            if expires <= now:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return None
+            if now - used > self.touch_interval:
+                self._conn.execute("UPDATE cache SET used = ? WHERE key = ?", (now, key))
+            return value
+
+    def set(self, key: str, value: str, ttl: float):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires, used) VALUES (?, ?, ?, ?)",
+                (key, value, now + ttl, now),
+            )
+            self._sets += 1
+            if self._sets % self.evict_every == 0:
+                self._evict(now)
+
+    def delete(self, *keys: str):
+        with self._lock:
+            self._conn.executemany("DELETE FROM cache WHERE key = ?", [(key,) for key in keys])
+
+    def _evict(self, now: float):
+        self._conn.execute("DELETE FROM cache WHERE expires <= ?", (now,))
+        excess = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY used LIMIT ?)", (excess,)
+            )
+
+
+class ReadThroughCache:
+    # Values are strings (JSON) so both backends behave the same and a cached
+    # value is never shared as a mutable object between requests. Hit and
+    # miss counts are per process.
+    def __init__(self, backend, ttl: float = 60):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: str):
+        self.backend.set(key, value, self.ttl)
+
+    def get_or_load(self, key: str, load: Callable[[], Optional[str]]) -> Optional[str]:
+        # Nothing is cached when load() finds nothing, so a row created later
+        # is picked up on the next lookup.
+        value = self.get(key)
+        if value is None:
+            value = load()
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    def invalidate(self, *keys: str):
+        self.backend.delete(*keys)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,234 @@
+"""Signing and verification keys for the OAuth2 examples, keyed by kid.
+
+Keys are parsed into python-jose Key objects once, when they are loaded, and
+reused for every token. With a JWKS file the keys are asymmetric, so services
+that only verify tokens need nothing but the public half (see
+KeyRing.public_jwks). To create the file or rotate in a new key:
+
+    python -m jwt_keys keys.json --algorithm EdDSA
+
+The newest key in the file signs new tokens; all of them still verify.
+"""
+import argparse
+import base64
+import json
+import os
+import time
+import uuid
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from jose import jwk
+from jose.backends.base import Key
+from jose.exceptions import JWKError
+
+
+def b64url_encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def b64url_decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+class Ed25519Key(Key):
+    # EdDSA over Ed25519 (RFC 8037). python-jose has no OKP keys of its own,
+    # so this one is registered with it below.
+    def __init__(self, key, algorithm):
+        if algorithm != "EdDSA":
+            raise JWKError(f"Ed25519 keys are for EdDSA, not {algorithm}")
+        self._algorithm = algorithm
+        if isinstance(key, (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey)):
+            self.prepared_key = key
+        elif isinstance(key, dict):
+            if key.get("kty") != "OKP" or key.get("crv") != "Ed25519":
+                raise JWKError("Not an Ed25519 JWK")
+            if "d" in key:
+                self.prepared_key = ed25519.Ed25519PrivateKey.from_private_bytes(b64url_decode(key["d"]))
+            else:
+                self.prepared_key = ed25519.Ed25519PublicKey.from_public_bytes(b64url_decode(key["x"]))
+        else:
+            if isinstance(key, str):
+                key = key.encode()
+            try:
+                self.prepared_key = serialization.load_pem_private_key(key, password=None)
+            except ValueError:
+                self.prepared_key = serialization.load_pem_public_key(key)
+            if not isinstance(self.prepared_key, (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey)):
+                raise JWKError("Not an Ed25519 key")
+
+    def sign(self, msg: bytes) -> bytes:
+        return self.prepared_key.sign(msg)
+
+    def verify(self, msg: bytes, sig: bytes) -> bool:
+        public_key = self.prepared_key
+        if isinstance(public_key, ed25519.Ed25519PrivateKey):
+            public_key = public_key.public_key()
+        try:
+            public_key.verify(sig, msg)
+        except InvalidSignature:
+            return False
+        return True
+
+    def public_key(self) -> "Ed25519Key":
+        if isinstance(self.prepared_key, ed25519.Ed25519PublicKey):
+            return self
+        return Ed25519Key(self.prepared_key.public_key(), self._algorithm)
+
+    def to_dict(self) -> dict:
+        public_key = self.public_key().prepared_key
+        data = {
+            "kty": "OKP",
+            "crv": "Ed25519",
+            "alg": self._algorithm,
+            "x": b64url_encode(public_key.public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)),
+        }
+        if isinstance(self.prepared_key, ed25519.Ed25519PrivateKey):
+            private_bytes = self.prepared_key.private_bytes(
+                serialization.Encoding.Raw, serialization.PrivateFormat.Raw, serialization.NoEncryption()
+            )
+            data["d"] = b64url_encode(private_bytes)
+        return data
+
+
+jwk.register_key("EdDSA", Ed25519Key)
+
+
+def generate_jwk(algorithm: str, kid: Optional[str] = None) -> dict:
+    if algorithm == "EdDSA":
+        key = Ed25519Key(ed25519.Ed25519PrivateKey.generate(), algorithm)
+    elif algorithm.startswith(("RS", "PS")):
+        key = jwk.construct(rsa.generate_private_key(public_exponent=65537, key_size=2048), algorithm)
+    elif algorithm.startswith("ES"):
+        curve = {"ES256": ec.SECP256R1(), "ES384": ec.SECP384R1(), "ES512": ec.SECP521R1()}[algorithm]
+        key = jwk.construct(ec.generate_private_key(curve), algorithm)
+    else:
+        raise ValueError(f"No key generation for {algorithm}")
+    return {**key.to_dict(), "alg": algorithm, "kid": kid or uuid.uuid4().hex}
+
+
+class KeyRing:
+    # kid -> (algorithm, signing Key, verification Key), all parsed up front.
+    # Either one shared secret (HS256 and friends, kid None) or the keys of a
+    # JWKS file, where tokens are verified with the public half (python-jose's
+    # EC keys cannot verify with the private one). The file is re-read
+    # whenever its mtime changes; the check runs at most every
+    # reload_interval seconds, from the lookups themselves or refresh().
+    def __init__(
+        self,
+        secret: Optional[str] = None,
+        algorithm: str = "HS256",
+        jwks_path: Optional[str] = None,
+        reload_interval: float = 1.0,
+    ):
+        self.jwks_path = jwks_path
+        self.reload_interval = reload_interval
+        self.reloads = 0
+        self._keys: Dict[Optional[str], Tuple[str, Key, Key]] = {}
+        self._signing_kid: Optional[str] = None
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._listeners: List[Callable[[Set[Optional[str]]], None]] = []
+        if jwks_path is not None:
+            self._reload()
+        else:
+            key = jwk.construct(secret, algorithm)
+            self._keys[None] = (algorithm, key, key)
+
+    def signing_key(self) -> Tuple[Optional[str], str, Key]:
+        self._maybe_reload()
+        algorithm, key, _ = self._keys[self._signing_kid]
+        return self._signing_kid, algorithm, key
+
+    def verification_key(self, kid: Optional[str]) -> Optional[Tuple[str, Key]]:
+        # kid comes from a header nobody has verified yet; anything but a
+        # string (or no kid at all) cannot name one of our keys.
+        if kid is not None and not isinstance(kid, str):
+            return None
+        self._maybe_reload()
+        entry = self._keys.get(kid)
+        if entry is None:
+            return None
+        return entry[0], entry[2]
+
+    def public_jwks(self) -> dict:
+        self._maybe_reload()
+        return {
+            "keys": [
+                {**public_key.to_dict(), "alg": algorithm, "kid": kid, "use": "sig"}
+                for kid, (algorithm, _, public_key) in self._keys.items()
+                if kid is not None
+            ]
+        }
+
+    def on_reload(self, listener: Callable[[Set[Optional[str]]], None]):
+        # Called after every reload with the kids that are gone, e.g. to drop
+        # cached tokens that were verified with one of them.
+        self._listeners.append(listener)
+
+    def refresh(self):
+        # For callers that skip the lookups on their fast path, so removed
+        # keys still take effect within reload_interval.
+        self._maybe_reload()
+
+    def _maybe_reload(self):
+        if self.jwks_path is None:
+            return
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        try:
+            if os.stat(self.jwks_path).st_mtime != self._mtime:
+                self._reload()
+        except Exception:
+            # Missing or broken file: keep verifying with the keys we have.
+            pass
+
+    def _reload(self):
+        mtime = os.stat(self.jwks_path).st_mtime
+        with open(self.jwks_path) as jwks_file:
+            entries = json.load(jwks_file)["keys"]
+        if not isinstance(entries, list) or not entries:
+            raise JWKError(f"No keys in {self.jwks_path}")
+        # Parse everything before swapping anything in.
+        keys = {}
+        for entry in entries:
+            if not isinstance(entry, dict) or entry.get("kty") not in ("RSA", "EC", "OKP"):
+                raise JWKError(f"Not an asymmetric JWK in {self.jwks_path}")
+            key = jwk.construct(entry, entry["alg"])
+            keys[entry["kid"]] = (entry["alg"], key, key.public_key())
+        removed = set(self._keys) - set(keys)
+        self._keys = keys
+        self._signing_kid = entries[-1]["kid"]
+        self._mtime = mtime
+        self._checked_at = time.monotonic()
+        self.reloads += 1
+        for listener in self._listeners:
+            listener(removed)
+
+
+def add_key(path: str, algorithm: str, kid: Optional[str] = None) -> dict:
+    entries = []
+    if os.path.exists(path):
+        with open(path) as jwks_file:
+            entries = json.load(jwks_file)["keys"]
+    entry = generate_jwk(algorithm, kid)
+    # Write the new file next to the old one and swap, so a reload never
+    # sees it half written.
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as jwks_file:
+        json.dump({"keys": entries + [entry]}, jwks_file)
+    os.replace(tmp_path, path)
+    return entry
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add a new signing key to a local JWKS file.")
+    parser.add_argument("path")
+    parser.add_argument("--algorithm", default="RS256", choices=["RS256", "ES256", "EdDSA"])
+    parser.add_argument("--kid")
+    args = parser.parse_args()
+    print(add_key(args.path, args.algorithm, args.kid)["kid"])
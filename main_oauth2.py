@@ -1,17 +1,32 @@
+import os
 from datetime import datetime, timedelta
 from typing import Optional
 
 from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from pydantic import BaseModel
 
+from password_hashing import PasswordHasher
+from rate_limit import LoginRateLimit, MemoryBuckets, SQLiteBuckets, TokenBucket
+from session_store import MemorySessionStore, SQLiteSessionStore
+from token_cache import VerifiedTokenCache
+from user_repository import DictUserBackend, UserRepository
+
 app = FastAPI()
 
 SECRET_KEY = "09d25e094faa6ca2556c818166b7a9563b93f7099f6f0f4caa6cf63b88e8d3e7"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# "jwt" issues signed tokens that any worker can verify on its own; "opaque"
+# issues random session ids that are looked up in a session store, which
+# expires them ACCESS_TOKEN_EXPIRE_MINUTES after their last use. Set
+# SESSION_STORE_PATH (e.g. to a file under /dev/shm) to share sessions
+# between workers.
+TOKEN_MODE = os.getenv("TOKEN_MODE", "jwt")
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH")
 
 fake_users_db = {
     "johndoe": {
@@ -43,32 +58,78 @@ class User(BaseModel):
 class UserInDB(User):
     hashed_password: str
 
+    class Config:
+        frozen = True
+
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashing and verification run on a process pool, off the event loop.
+password_hasher = PasswordHasher(
+    schemes=pwd_context.schemes(),
+    max_workers=int(os.getenv("PASSWORD_HASH_WORKERS", "0")) or None,
+)
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
-
-
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
-
-
-def get_user(db, username: str):
-    if username in db:
-        user_dict = db[username]
-        return UserInDB(**user_dict)
-
-
-def authenticate_user(fake_db, username: str, password: str):
-    user = get_user(fake_db, username)
+# Repeat requests with the same bearer token skip jwt.decode and get_user.
+token_cache = VerifiedTokenCache(max_entries=int(os.getenv("TOKEN_CACHE_SIZE", "10000")))
+# UserInDB instances are validated once per change instead of per lookup.
+users = UserRepository(
+    DictUserBackend(fake_users_db),
+    UserInDB,
+    refresh_interval=float(os.getenv("USER_REFRESH_INTERVAL", "5")),
+)
+users.on_change(token_cache.forget_subject)
+# Login attempts are limited per username and per client address before any
+# password is verified. Set LOGIN_RATE_LIMIT_PATH (e.g. to a file under
+# /dev/shm) to share the buckets between workers.
+LOGIN_RATE_LIMIT_PATH = os.getenv("LOGIN_RATE_LIMIT_PATH")
+login_buckets = SQLiteBuckets(LOGIN_RATE_LIMIT_PATH) if LOGIN_RATE_LIMIT_PATH else MemoryBuckets()
+login_rate_limit = LoginRateLimit(
+    per_username=TokenBucket(
+        "username",
+        capacity=int(os.getenv("LOGIN_USERNAME_BURST", "10")),
+        per_second=float(os.getenv("LOGIN_USERNAME_PER_MINUTE", "10")) / 60,
+        backend=login_buckets,
+    ),
+    per_ip=TokenBucket(
+        "ip",
+        capacity=int(os.getenv("LOGIN_IP_BURST", "50")),
+        per_second=float(os.getenv("LOGIN_IP_PER_MINUTE", "100")) / 60,
+        backend=login_buckets,
+    ),
+)
+if SESSION_STORE_PATH:
+    sessions = SQLiteSessionStore(SESSION_STORE_PATH, ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+else:
+    sessions = MemorySessionStore(ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+
+async def call_session_store(method, *args):
+    # The shared SQLite store may have to wait for another worker's write, so
+    # its calls go to the threadpool; the in-memory one answers on the loop.
+    if isinstance(sessions, SQLiteSessionStore):
+        return await run_in_threadpool(method, *args)
+    return method(*args)
+
+
+async def verify_password(plain_password, hashed_password):
+    return await password_hasher.verify(plain_password, hashed_password)
+
+
+async def get_password_hash(password):
+    return await password_hasher.hash(password)
+
+
+async def get_user(username: str):
+    return await users.get(username)
+
+
+async def authenticate_user(username: str, password: str):
+    user = await get_user(username)
     if not user:
         return False
-    if not pwd_context.verify(password, user.hashed_password):
+    if not await verify_password(password, user.hashed_password):
         return False
     return user
 
@@ -90,6 +151,17 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    if TOKEN_MODE == "opaque":
+        username = await call_session_store(sessions.get, token)
+        user = await get_user(username) if username is not None else None
+        if user is None:
+            raise credentials_exception
+        return user
+    user = token_cache.get(token)
+    if user is not None:
+        return user
+    if token_cache.is_revoked(token):
+        raise credentials_exception
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -98,9 +170,10 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         token_data = TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    user = get_user(fake_users_db, username=token_data.username)
+    user = await get_user(username=token_data.username)
     if user is None:
         raise credentials_exception
+    token_cache.put(token, payload["exp"], user.username, user)
     return user
 
 
@@ -110,15 +183,18 @@ async def get_current_active_user(current_user: User = Depends(get_current_user)
     return current_user
 
 
-@app.post("/token", response_model=Token)
+@app.post("/token", response_model=Token, dependencies=[Depends(login_rate_limit)])
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = authenticate_user(fake_users_db, form_data.username, form_data.password)
+    user = await authenticate_user(form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    if TOKEN_MODE == "opaque":
+        session_id = await call_session_store(sessions.create, user.username)
+        return {"access_token": session_id, "token_type": "bearer"}
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": user.username}, expires_delta=access_token_expires
@@ -126,6 +202,27 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     return {"access_token": access_token, "token_type": "bearer"}
 
 
+@app.on_event("startup")
+async def start_user_refresh():
+    await users.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_password_hasher():
+    await users.stop()
+    password_hasher.shutdown()
+
+
+@app.get("/token/stats")
+async def read_token_stats():
+    return {
+        "password_hasher": password_hasher.stats(),
+        "token_cache": token_cache.stats(),
+        "rate_limit": login_rate_limit.stats(),
+        "sessions": await call_session_store(sessions.stats),
+    }
+
+
 @app.get("/users/me")
 async def read_users_me(current_user: User = Depends(get_current_active_user)):
     return current_user
@@ -134,3 +231,12 @@ async def read_users_me(current_user: User = Depends(get_current_active_user)):
 @app.get("/users/me/items/")
 async def read_own_items(current_user: User = Depends(get_current_active_user)):
     return [{"item_id": "Foo", "owner": current_user.username}]
+
+
+@app.post("/token/revoke", status_code=status.HTTP_204_NO_CONTENT)
+async def revoke_access_token(token: str = Depends(oauth2_scheme), current_user: User = Depends(get_current_user)):
+    if TOKEN_MODE == "opaque":
+        await call_session_store(sessions.revoke, token)
+        return
+    # get_current_user has already checked the signature.
+    token_cache.revoke(token, jwt.get_unverified_claims(token)["exp"])
@@ -1,7 +1,8 @@
+import os
 from datetime import datetime, timedelta
 from typing import List, Optional
 
-from fastapi import Depends, FastAPI, HTTPException, Security, status
+from fastapi import Depends, FastAPI, HTTPException, Request, Security, status
 from fastapi.security import (
     OAuth2PasswordBearer,
     OAuth2PasswordRequestForm,
@@ -11,11 +12,23 @@ from jose import JWTError, jwt
 from passlib.context import CryptContext
 from pydantic import BaseModel, ValidationError
 
+from jwt_keys import KeyRing
+from password_hashing import PasswordHasher
+from rate_limit import LoginRateLimit, MemoryBuckets, SQLiteBuckets, TokenBucket
+from token_cache import VerifiedTokenCache
+from user_repository import DictUserBackend, UserRepository
+
 # to get a string like this run:
 # openssl rand -hex 32
 SECRET_KEY = "09d25e094faa6ca2556c818166b7a9563b93f7099f6f0f4caa6cf63b88e8d3e7"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# With a JWKS file (see jwt_keys), tokens are signed with its newest private
+# key and carry its kid, and anyone holding the public keys from
+# /.well-known/jwks.json can verify them. Without one, SECRET_KEY and
+# ALGORITHM are used as before.
+JWT_JWKS_PATH = os.getenv("JWT_JWKS_PATH")
+keyring = KeyRing(jwks_path=JWT_JWKS_PATH) if JWT_JWKS_PATH else KeyRing(SECRET_KEY, ALGORITHM)
 fake_users_db = {
     "johndoe": {
         "username": "johndoe",
@@ -56,35 +69,84 @@ class User(BaseModel):
 class UserInDB(User):
     hashed_password: str
 
+    class Config:
+        frozen = True
+
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashing and verification run on a process pool, off the event loop.
+password_hasher = PasswordHasher(
+    schemes=pwd_context.schemes(),
+    max_workers=int(os.getenv("PASSWORD_HASH_WORKERS", "0")) or None,
+)
 oauth2_scheme = OAuth2PasswordBearer(
     tokenUrl="token",
     scopes={"me": "Read information about the current user.", "items": "Read items."},
 )
+# Repeat requests with the same bearer token skip jwt.decode, TokenData and
+# get_user; only the scope check below runs again.
+token_cache = VerifiedTokenCache(max_entries=int(os.getenv("TOKEN_CACHE_SIZE", "10000")))
+# Number of jwt.decode calls made. Every Security() dependency in a request
+# shares one resolution, so this never grows by more than one per request.
+token_decodes = 0
+# UserInDB instances are validated once per change instead of per lookup.
+users = UserRepository(
+    DictUserBackend(fake_users_db),
+    UserInDB,
+    refresh_interval=float(os.getenv("USER_REFRESH_INTERVAL", "5")),
+)
+users.on_change(token_cache.forget_subject)
+
+
+def forget_removed_keys(removed_kids):
+    # Cached tokens skip the signature check, so once a key leaves the JWKS
+    # file the tokens it signed have to be verified again, and fail.
+    if removed_kids:
+        token_cache.clear()
+
+
+keyring.on_reload(forget_removed_keys)
+
+# Login attempts are limited per username and per client address before any
+# password is verified. Set LOGIN_RATE_LIMIT_PATH (e.g. to a file under
+# /dev/shm) to share the buckets between workers.
+LOGIN_RATE_LIMIT_PATH = os.getenv("LOGIN_RATE_LIMIT_PATH")
+login_buckets = SQLiteBuckets(LOGIN_RATE_LIMIT_PATH) if LOGIN_RATE_LIMIT_PATH else MemoryBuckets()
+login_rate_limit = LoginRateLimit(
+    per_username=TokenBucket(
+        "username",
+        capacity=int(os.getenv("LOGIN_USERNAME_BURST", "10")),
+        per_second=float(os.getenv("LOGIN_USERNAME_PER_MINUTE", "10")) / 60,
+        backend=login_buckets,
+    ),
+    per_ip=TokenBucket(
+        "ip",
+        capacity=int(os.getenv("LOGIN_IP_BURST", "50")),
+        per_second=float(os.getenv("LOGIN_IP_PER_MINUTE", "100")) / 60,
+        backend=login_buckets,
+    ),
+)
 
 app = FastAPI()
 
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password, hashed_password):
+    return await password_hasher.verify(plain_password, hashed_password)
 
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    return await password_hasher.hash(password)
 
 
-def get_user(db, username: str):
-    if username in db:
-        user_dict = db[username]
-        return UserInDB(**user_dict)
+async def get_user(username: str):
+    return await users.get(username)
 
 
-def authenticate_user(fake_db, username: str, password: str):
-    user = get_user(fake_db, username)
+async def authenticate_user(username: str, password: str):
+    user = await get_user(username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password(password, user.hashed_password):
         return False
     return user
 
@@ -96,22 +158,35 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    kid, algorithm, key = keyring.signing_key()
+    encoded_jwt = jwt.encode(to_encode, key, algorithm=algorithm, headers={"kid": kid} if kid else None)
     return encoded_jwt
 
 
-async def get_current_user(security_scopes: SecurityScopes, token: str = Depends(oauth2_scheme)):
+def authenticate_value(security_scopes: SecurityScopes) -> str:
     if security_scopes.scopes:
-        authenticate_value = f'Bearer scope="{security_scopes.scope_str}"'
-    else:
-        authenticate_value = f"Bearer"
+        return f'Bearer scope="{security_scopes.scope_str}"'
+    return "Bearer"
+
+
+async def resolve_token(security_scopes: SecurityScopes, token: str):
+    global token_decodes
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
-        headers={"WWW-Authenticate": authenticate_value},
+        headers={"WWW-Authenticate": authenticate_value(security_scopes)},
     )
+    if token_cache.is_revoked(token):
+        raise credentials_exception
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        token_decodes += 1
+        # The key comes already parsed; only the algorithm it was registered
+        # with is accepted for it.
+        verification_key = keyring.verification_key(jwt.get_unverified_header(token).get("kid"))
+        if verification_key is None:
+            raise credentials_exception
+        algorithm, key = verification_key
+        payload = jwt.decode(token, key, algorithms=[algorithm])
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
@@ -119,15 +194,33 @@ async def get_current_user(security_scopes: SecurityScopes, token: str = Depends
         token_data = TokenData(scopes=token_scopes, username=username)
     except (JWTError, ValidationError):
         raise credentials_exception
-    user = get_user(fake_users_db, username=token_data.username)
+    user = await get_user(username=token_data.username)
     if user is None:
         raise credentials_exception
+    resolved = (user, token_data.scopes)
+    token_cache.put(token, payload["exp"], user.username, resolved)
+    return resolved
+
+
+async def get_current_user(request: Request, security_scopes: SecurityScopes, token: str = Depends(oauth2_scheme)):
+    # FastAPI caches dependencies per (function, scopes), so get_current_user
+    # runs once for each distinct set of scopes asked for in a request. The
+    # token is resolved by the first of those runs and kept on the request;
+    # the others only check their own scopes against it.
+    resolved = getattr(request.state, "resolved_token", None)
+    if resolved is None:
+        keyring.refresh()
+        resolved = token_cache.get(token)
+        if resolved is None:
+            resolved = await resolve_token(security_scopes, token)
+        request.state.resolved_token = resolved
+    user, token_scopes = resolved
     for scope in security_scopes.scopes:
-        if scope not in token_data.scopes:
+        if scope not in token_scopes:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Not enough permissions",
-                headers={"WWW-Authenticate": authenticate_value},
+                headers={"WWW-Authenticate": authenticate_value(security_scopes)},
             )
     return user
 
@@ -138,10 +231,9 @@ async def get_current_active_user(current_user: User = Security(get_current_user
     return current_user
 
 
-@app.post("/token", response_model=Token)
+@app.post("/token", response_model=Token, dependencies=[Depends(login_rate_limit)])
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = authenticate_user(fake_users_db, form_data.username,
-    form_data.password)
+    user = await authenticate_user(form_data.username, form_data.password)
     if not user:
         raise HTTPException(status_code=400, detail="Incorrect username or password")
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -152,6 +244,31 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     return {"access_token": access_token, "token_type": "bearer"}
 
 
+@app.on_event("startup")
+async def start_user_refresh():
+    await users.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_password_hasher():
+    await users.stop()
+    password_hasher.shutdown()
+
+
+@app.get("/token/stats")
+async def read_token_stats():
+    return {
+        "password_hasher": password_hasher.stats(),
+        "token_cache": token_cache.stats(),
+        "rate_limit": login_rate_limit.stats(),
+    }
+
+
+@app.get("/.well-known/jwks.json")
+async def read_jwks():
+    return keyring.public_jwks()
+
+
 @app.get("/users/me/", response_model=User)
 async def read_users_me(current_user: User = Depends(get_current_active_user)):
     return current_user
@@ -165,3 +282,9 @@ async def read_own_items(current_user: User = Security(get_current_active_user,
 @app.get("/status/")
 async def read_system_status(current_user: User = Depends(get_current_user)):
     return {"status": "ok"}
+
+
+@app.post("/token/revoke", status_code=status.HTTP_204_NO_CONTENT)
+async def revoke_access_token(token: str = Depends(oauth2_scheme), current_user: User = Depends(get_current_user)):
+    # get_current_user has already checked the signature.
+    token_cache.revoke(token, jwt.get_unverified_claims(token)["exp"])
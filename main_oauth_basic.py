@@ -1,23 +1,79 @@
-import secrets
+import os
 
 from fastapi import Depends, FastAPI, HTTPException, status
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from pydantic import BaseModel
+
+from basic_auth import BasicAuthBackend
+from password_hashing import PasswordHasher
+from user_repository import DictUserBackend, UserRepository
 
 app = FastAPI()
 
 security = HTTPBasic()
 
+fake_users_db = {
+    "stanleyjobson": {
+        "username": "stanleyjobson",
+        "hashed_password": "$2b$12$ildUchAflj7CawpVeIw8le1Pgdq99FvdmeQXhNGXnFuelA4MMOfNa",
+    }
+}
+# Checked instead when the username does not exist, so that costs as much as
+# a wrong password. Nothing hashes to it.
+DUMMY_HASH = "$2b$12$dl5Psh2ezXTm1Ew1ilULJedpX.8vzGnJLpE5RKNtbIw7V7yUewdMy"
+
+
+class UserInDB(BaseModel):
+    username: str
+    hashed_password: str
+
+    class Config:
+        frozen = True
+
+
+password_hasher = PasswordHasher(max_workers=int(os.getenv("PASSWORD_HASH_WORKERS", "0")) or None)
+users = UserRepository(
+    DictUserBackend(fake_users_db),
+    UserInDB,
+    refresh_interval=float(os.getenv("USER_REFRESH_INTERVAL", "5")),
+)
+# Successful checks are remembered for BASIC_AUTH_CACHE_TTL seconds (0 turns
+# the cache off), so clients sending the same credentials every request do
+# not pay for bcrypt every time.
+basic_auth = BasicAuthBackend(
+    users,
+    password_hasher,
+    dummy_hash=DUMMY_HASH,
+    cache_ttl=float(os.getenv("BASIC_AUTH_CACHE_TTL", "60")),
+    max_entries=int(os.getenv("BASIC_AUTH_CACHE_SIZE", "10000")),
+)
+
 
-def get_current_username(credentials: HTTPBasicCredentials = Depends(security)):
-    correct_username = secrets.compare_digest(credentials.username,"stanleyjobson")
-    correct_password = secrets.compare_digest(credentials.password,"swordfish")
-    if not (correct_username and correct_password):
+async def get_current_username(credentials: HTTPBasicCredentials = Depends(security)):
+    user = await basic_auth.authenticate(credentials.username, credentials.password)
+    if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Basic"},
         )
-    return credentials.username
+    return user.username
+
+
+@app.on_event("startup")
+async def start_user_refresh():
+    await users.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_password_hasher():
+    await users.stop()
+    password_hasher.shutdown()
+
+
+@app.get("/auth/stats")
+async def read_auth_stats():
+    return {"password_hasher": password_hasher.stats(), "basic_auth": basic_auth.stats()}
 
 
 @app.get("/users/me")
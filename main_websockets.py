@@ -1,10 +1,22 @@
-from typing import Optional, List
+import asyncio
+import json
+import os
+import struct
+import zlib
+from collections import deque
+from enum import Enum
+from typing import Callable, Deque, Dict, Optional, List, Set, Tuple
 
+import msgpack
 from fastapi import FastAPI, WebSocket, status, Cookie, Depends, Query, WebSocketDisconnect
 from fastapi.responses import HTMLResponse
+from starlette.websockets import WebSocketState
 
 app = FastAPI()
 
+# Directory shared by all uvicorn workers; leave unset to run single-process.
+BACKPLANE_DIR = os.getenv("WS_BACKPLANE_DIR")
+
 html = """
 <!DOCTYPE html>
 <html>
@@ -45,26 +57,504 @@ html = """
 """
 
 
+# Chat messages are dicts such as {"event": "say", "client_id": 1, "text": "hi"}.
+# Text clients receive them rendered as the familiar chat lines; binary clients
+# pick a msgpack codec by offering its websocket subprotocol.
+TEXT_FORMATS = {
+    "echo": "You wrote: {text}",
+    "say": "Client #{client_id} says: {text}",
+    "left": "Client #{client_id} left the chat",
+}
+
+
+class Codec:
+    name = "text"
+    subprotocol: Optional[str] = None
+
+    def encode(self, message: dict) -> dict:
+        return {"type": "websocket.send", "text": TEXT_FORMATS[message["event"]].format(**message)}
+
+    async def receive(self, websocket: WebSocket) -> str:
+        return await websocket.receive_text()
+
+
+class MsgpackCodec(Codec):
+    name = "msgpack"
+    subprotocol = "chat.msgpack"
+
+    def encode(self, message: dict) -> dict:
+        return {"type": "websocket.send", "bytes": self.pack(message)}
+
+    def pack(self, message: dict) -> bytes:
+        return msgpack.packb(message)
+
+    def unpack(self, data: bytes) -> dict:
+        return msgpack.unpackb(data)
+
+    async def receive(self, websocket: WebSocket) -> str:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message["code"], message.get("reason"))
+        try:
+            text = self.unpack(message.get("bytes") or b"")["text"]
+        except (ValueError, TypeError, KeyError, zlib.error, msgpack.UnpackException):
+            text = None
+        if not isinstance(text, str):
+            await websocket.close(code=status.WS_1003_UNSUPPORTED_DATA)
+            raise WebSocketDisconnect(status.WS_1003_UNSUPPORTED_DATA)
+        return text
+
+
+class DeflateMsgpackCodec(MsgpackCodec):
+    # Per-message compression: a leading flag byte says whether the msgpack
+    # body is raw (0) or deflated (1). Only bodies of at least min_size bytes
+    # that actually shrink are sent compressed.
+    name = "msgpack+deflate"
+    subprotocol = "chat.msgpack.deflate"
+
+    def __init__(self, min_size: int = 256, level: int = 6, max_size: int = 65536):
+        self.min_size = min_size
+        self.level = level
+        self.max_size = max_size
+
+    def pack(self, message: dict) -> bytes:
+        body = msgpack.packb(message)
+        if len(body) >= self.min_size:
+            compressed = zlib.compress(body, self.level)
+            if len(compressed) < len(body):
+                return b"\x01" + compressed
+        return b"\x00" + body
+
+    def unpack(self, data: bytes) -> dict:
+        if data[:1] == b"\x00":
+            return msgpack.unpackb(data[1:])
+        if data[:1] != b"\x01":
+            raise ValueError("Unknown frame flag")
+        decompressor = zlib.decompressobj()
+        body = decompressor.decompress(data[1:], self.max_size)
+        if decompressor.unconsumed_tail:
+            raise ValueError("Message too large")
+        return msgpack.unpackb(body)
+
+
+TEXT_CODEC = Codec()
+CODECS = {codec.subprotocol: codec for codec in (MsgpackCodec(), DeflateMsgpackCodec())}
+
+
+def negotiate_codec(websocket: WebSocket) -> Codec:
+    for subprotocol in websocket.scope.get("subprotocols", []):
+        if subprotocol in CODECS:
+            return CODECS[subprotocol]
+    return TEXT_CODEC
+
+
+class OverflowPolicy(str, Enum):
+    drop_oldest = "drop-oldest"
+    drop_newest = "drop-newest"
+    coalesce = "coalesce"
+    disconnect = "disconnect"
+
+
+class Outbox:
+    def __init__(
+        self,
+        websocket: WebSocket,
+        client_id: int,
+        codec: Codec,
+        max_size: int,
+        policy: OverflowPolicy,
+    ):
+        self.websocket = websocket
+        self.client_id = client_id
+        self.codec = codec
+        self.max_size = max_size
+        self.policy = policy
+        self.frames: Deque[dict] = deque()
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.topics: Set[str] = set()
+        self.sending_since: Optional[float] = None
+        self.writer: Optional[asyncio.Task] = None
+        self._ready = asyncio.Event()
+
+    @property
+    def depth(self) -> int:
+        return len(self.frames)
+
+    def put(self, frame: dict) -> bool:
+        # False tells the manager to drop the connection.
+        if len(self.frames) < self.max_size:
+            self.frames.append(frame)
+        elif self.policy == OverflowPolicy.disconnect:
+            return False
+        elif self.policy == OverflowPolicy.drop_newest:
+            self.dropped += 1
+        elif self.policy == OverflowPolicy.coalesce and "text" in self.frames[-1] and "text" in frame:
+            text = f"{self.frames[-1]['text']}\n{frame['text']}"
+            self.frames[-1] = {"type": "websocket.send", "text": text}
+            self.coalesced += 1
+        else:
+            self.frames.popleft()
+            self.frames.append(frame)
+            self.dropped += 1
+        self._ready.set()
+        return True
+
+    async def get(self) -> dict:
+        while not self.frames:
+            self._ready.clear()
+            await self._ready.wait()
+        return self.frames.popleft()
+
+    def stats(self) -> dict:
+        return {
+            "client_id": self.client_id,
+            "codec": self.codec.name,
+            "topics": sorted(self.topics),
+            "depth": self.depth,
+            "max_size": self.max_size,
+            "policy": self.policy,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+        }
+
+
+class Backplane:
+    # Single-process default: there is nobody else to forward messages to.
+    # Messages go out with the list of topics they were published to, or
+    # None for every connection.
+    async def start(self, deliver: Callable[[Optional[List[str]], dict], None]):
+        pass
+
+    async def publish(self, topics: Optional[List[str]], message: dict):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class UnixSocketBackplane(Backplane):
+    # Full mesh between worker processes: every worker listens on
+    # <directory>/<pid>.sock and connects to the sockets of the others.
+    # Messages are buffered for batch_interval seconds (or until max_batch are
+    # pending) and written to each peer as one length-prefixed JSON frame.
+    def __init__(
+        self,
+        directory: str,
+        batch_interval: float = 0.002,
+        max_batch: int = 256,
+        discovery_interval: float = 1.0,
+    ):
+        self.directory = directory
+        self.path = os.path.join(directory, f"{os.getpid()}.sock")
+        self.batch_interval = batch_interval
+        self.max_batch = max_batch
+        self.discovery_interval = discovery_interval
+        self.peers: Dict[str, asyncio.StreamWriter] = {}
+        # Connections other workers opened to us, closed on stop() so their
+        # readers do not outlive the server.
+        self._inbound: Set[asyncio.StreamWriter] = set()
+        self.batches_sent = 0
+        self.messages_sent = 0
+        self._pending: List[Tuple[Optional[List[str]], dict]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._deliver: Optional[Callable[[Optional[List[str]], dict], None]] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._discovery: Optional[asyncio.Task] = None
+        self._discover_now: Optional[asyncio.Event] = None
+
+    async def start(self, deliver: Callable[[Optional[List[str]], dict], None]):
+        self._deliver = deliver
+        self._discover_now = asyncio.Event()
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._read_peer, path=self.path)
+        await self._discover()
+        self._discovery = asyncio.ensure_future(self._discover_forever())
+
+    async def publish(self, topics: Optional[List[str]], message: dict):
+        if not self.peers:
+            return
+        self._pending.append((topics, message))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.batch_interval, self._flush)
+        # drain() only blocks once a peer is behind by more than the stream's
+        # high-water mark, which pushes back on the publishing client.
+        await asyncio.gather(*[self._drain(path, writer) for path, writer in list(self.peers.items())])
+
+    async def stop(self):
+        self._flush()
+        if self._discovery is not None:
+            self._discovery.cancel()
+        writers = list(self.peers.values()) + list(self._inbound)
+        for writer in writers:
+            writer.close()
+        self.peers.clear()
+        if self._server is not None:
+            self._server.close()
+        await asyncio.gather(*[writer.wait_closed() for writer in writers], return_exceptions=True)
+        if self._server is not None:
+            await self._server.wait_closed()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
+            return
+        body = json.dumps(self._pending).encode()
+        frame = struct.pack("!I", len(body)) + body
+        self.batches_sent += 1
+        self.messages_sent += len(self._pending)
+        self._pending = []
+        for path, writer in list(self.peers.items()):
+            if writer.is_closing():
+                del self.peers[path]
+            else:
+                writer.write(frame)
+
+    async def _drain(self, path: str, writer: asyncio.StreamWriter):
+        try:
+            await writer.drain()
+        except (ConnectionError, OSError):
+            writer.close()
+            self.peers.pop(path, None)
+
+    async def _read_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # A worker we may not know yet is talking to us; connect back right
+        # away instead of waiting for the next discovery round.
+        self._discover_now.set()
+        self._inbound.add(writer)
+        try:
+            while True:
+                header = await reader.readexactly(4)
+                body = await reader.readexactly(struct.unpack("!I", header)[0])
+                for topics, message in json.loads(body):
+                    self._deliver(topics, message)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._inbound.discard(writer)
+            writer.close()
+
+    async def _discover_forever(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._discover_now.wait(), timeout=self.discovery_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._discover_now.clear()
+            await self._discover()
+
+    async def _discover(self):
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not name.endswith(".sock") or path == self.path or path in self.peers:
+                continue
+            try:
+                _, writer = await asyncio.open_unix_connection(path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                self._remove_stale(path)
+                continue
+            self.peers[path] = writer
+
+    def _remove_stale(self, path: str):
+        # Only clean up after workers that are gone, not ones still starting up.
+        try:
+            os.kill(int(os.path.basename(path)[: -len(".sock")]), 0)
+        except ProcessLookupError:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        except (ValueError, PermissionError):
+            pass
+
+
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+    def __init__(
+        self,
+        send_timeout: float = 5.0,
+        close_timeout: float = 1.0,
+        queue_size: int = 100,
+        overflow_policy: OverflowPolicy = OverflowPolicy.drop_oldest,
+        backplane: Optional[Backplane] = None,
+    ):
+        self.active_connections: Dict[int, Outbox] = {}
+        self.topics: Dict[str, Dict[int, Outbox]] = {}
+        self.send_timeout = send_timeout
+        self.close_timeout = close_timeout
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.backplane = backplane or Backplane()
+        self._closing: Set[asyncio.Task] = set()
+        self._watchdog: Optional[asyncio.Task] = None
+
+    async def start(self):
+        await self.backplane.start(self.deliver)
+
+    async def stop(self):
+        await self.backplane.stop()
+
+    async def connect(self, websocket: WebSocket, client_id: int, codec: Codec = TEXT_CODEC):
+        await websocket.accept(subprotocol=codec.subprotocol)
+        previous = self.active_connections.get(client_id)
+        if previous is not None:
+            self.evict(previous)
+        outbox = Outbox(websocket, client_id, codec, self.queue_size, self.overflow_policy)
+        outbox.writer = asyncio.ensure_future(self._write(outbox))
+        self.active_connections[client_id] = outbox
+        if self._watchdog is None or self._watchdog.done():
+            self._watchdog = asyncio.ensure_future(self._evict_stuck())
+
+    def disconnect(self, client_id: int, websocket: Optional[WebSocket] = None) -> bool:
+        # Passing the websocket keeps a late disconnect of a replaced
+        # connection from dropping the client's new one. Returns whether the
+        # client's current connection was the one removed.
+        outbox = self.active_connections.get(client_id)
+        if outbox is not None and websocket in (None, outbox.websocket):
+            self._remove(outbox)
+            return True
+        return False
+
+    def join(self, client_id: int, topic: str):
+        outbox = self.active_connections.get(client_id)
+        if outbox is not None:
+            outbox.topics.add(topic)
+            self.topics.setdefault(topic, {})[client_id] = outbox
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+    def leave(self, client_id: int, topic: str):
+        outbox = self.active_connections.get(client_id)
+        if outbox is not None:
+            outbox.topics.discard(topic)
+            self._unsubscribe(outbox, topic)
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+    async def send_personal_message(self, message: dict, client_id: int):
+        outbox = self.active_connections.get(client_id)
+        if outbox is not None:
+            self._enqueue(outbox, outbox.codec.encode(message))
 
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
+    async def publish(self, topic: str, message: dict):
+        await self.publish_many([topic], message)
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            await connection.send_text(message)
+    async def publish_many(self, topics: List[str], message: dict):
+        # Subscribers of several of the topics still get the message once.
+        self.deliver(topics, message)
+        await self.backplane.publish(topics, message)
 
+    async def broadcast(self, message: dict):
+        self.deliver(None, message)
+        await self.backplane.publish(None, message)
 
-manager = ConnectionManager()
+    def deliver(self, topics: Optional[List[str]], message: dict):
+        # Local fan-out only; topics of None means every connection. The
+        # message is encoded once per codec and the resulting ASGI frame is
+        # shared by every recipient using that codec. Each writer task delivers
+        # it at its own pace so a slow client only delays itself.
+        if topics is None:
+            recipients = list(self.active_connections.values())
+        else:
+            subscribers: Dict[int, Outbox] = {}
+            for topic in topics:
+                subscribers.update(self.topics.get(topic, {}))
+            recipients = list(subscribers.values())
+        frames: Dict[Codec, dict] = {}
+        for outbox in recipients:
+            frame = frames.get(outbox.codec)
+            if frame is None:
+                frame = frames[outbox.codec] = outbox.codec.encode(message)
+            self._enqueue(outbox, frame)
+
+    def stats(self) -> List[dict]:
+        return [outbox.stats() for outbox in self.active_connections.values()]
+
+    def is_open(self, websocket: WebSocket) -> bool:
+        return (
+            websocket.client_state == WebSocketState.CONNECTED
+            and websocket.application_state == WebSocketState.CONNECTED
+        )
+
+    def evict(self, outbox: Outbox):
+        self._remove(outbox)
+        if outbox.websocket.application_state == WebSocketState.CONNECTED:
+            task = asyncio.ensure_future(self._close(outbox.websocket))
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+
+    def _remove(self, outbox: Outbox):
+        if self.active_connections.get(outbox.client_id) is outbox:
+            del self.active_connections[outbox.client_id]
+        for topic in outbox.topics:
+            self._unsubscribe(outbox, topic)
+        if outbox.writer is not asyncio.current_task():
+            outbox.writer.cancel()
+
+    def _unsubscribe(self, outbox: Outbox, topic: str):
+        subscribers = self.topics.get(topic)
+        if subscribers is not None and subscribers.get(outbox.client_id) is outbox:
+            del subscribers[outbox.client_id]
+            if not subscribers:
+                del self.topics[topic]
+
+    def _enqueue(self, outbox: Outbox, frame: dict):
+        if not self.is_open(outbox.websocket) or not outbox.put(frame):
+            self.evict(outbox)
+
+    async def _write(self, outbox: Outbox):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                frame = await outbox.get()
+                outbox.sending_since = loop.time()
+                await outbox.websocket.send(frame)
+                outbox.sending_since = None
+                outbox.sent += 1
+        except (WebSocketDisconnect, RuntimeError, OSError):
+            self.evict(outbox)
+
+    async def _evict_stuck(self):
+        # A single sweeper enforces send_timeout for every writer, which is much
+        # cheaper than wrapping each send in its own timeout task.
+        loop = asyncio.get_running_loop()
+        while self.active_connections:
+            await asyncio.sleep(self.send_timeout / 2)
+            deadline = loop.time() - self.send_timeout
+            for outbox in list(self.active_connections.values()):
+                if outbox.sending_since is not None and outbox.sending_since < deadline:
+                    self.evict(outbox)
+
+    async def _close(self, websocket: WebSocket):
+        try:
+            await asyncio.wait_for(
+                websocket.close(code=status.WS_1008_POLICY_VIOLATION),
+                timeout=self.close_timeout,
+            )
+        except (asyncio.TimeoutError, WebSocketDisconnect, RuntimeError, OSError):
+            pass
+
+
+manager = ConnectionManager(
+    backplane=UnixSocketBackplane(BACKPLANE_DIR) if BACKPLANE_DIR else None,
+)
+
+
+@app.on_event("startup")
+async def startup():
+    await manager.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await manager.stop()
 
 
 @app.get("/")
@@ -72,14 +562,25 @@ async def get():
     return HTMLResponse(html)
 
 
+@app.get("/ws/stats")
+async def connection_stats():
+    return manager.stats()
+
+
 @app.websocket("/ws/{client_id}")
-async def websocket_endpoint(websocket: WebSocket, client_id: int):
-    await manager.connect(websocket)
+async def websocket_endpoint(websocket: WebSocket, client_id: int, rooms: List[str] = Query(["lobby"])):
+    rooms = list(dict.fromkeys(rooms))
+    codec = negotiate_codec(websocket)
+    await manager.connect(websocket, client_id, codec)
+    for room in rooms:
+        manager.join(client_id, room)
     try:
         while True:
-            data = await websocket.receive_text()
-            await manager.send_personal_message(f"You wrote: {data}", websocket)
-            await manager.broadcast(f"Client #{client_id} says: {data}")
+            data = await codec.receive(websocket)
+            await manager.send_personal_message({"event": "echo", "text": data}, client_id)
+            await manager.publish_many(rooms, {"event": "say", "client_id": client_id, "text": data})
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
-        await manager.broadcast(f"Client #{client_id} left the chat")
+        # A connection replaced by a newer one for the same client_id has not
+        # left the chat.
+        if manager.disconnect(client_id, websocket):
+            await manager.publish_many(rooms, {"event": "left", "client_id": client_id})
@@ -0,0 +1,84 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from passlib.context import CryptContext
+
+# One CryptContext per worker process, built on first use there.
+_contexts: Dict[Tuple[str, ...], CryptContext] = {}
+
+
+def _context(schemes: Tuple[str, ...]) -> CryptContext:
+    if schemes not in _contexts:
+        _contexts[schemes] = CryptContext(schemes=list(schemes), deprecated="auto")
+    return _contexts[schemes]
+
+
+def _verify(schemes: Tuple[str, ...], plain_password: str, hashed_password: str) -> bool:
+    return _context(schemes).verify(plain_password, hashed_password)
+
+
+def _hash(schemes: Tuple[str, ...], password: str) -> str:
+    return _context(schemes).hash(password)
+
+
+class PasswordHasher:
+    # bcrypt takes hundreds of milliseconds of CPU per call, which would
+    # freeze the event loop for every other request. Calls run on a process
+    # pool instead, at most max_concurrency at a time; the rest wait their
+    # turn here, and that wait is what queue_time measures.
+    def __init__(self, schemes=("bcrypt",), max_workers: Optional[int] = None, max_concurrency: Optional[int] = None):
+        self.schemes = tuple(schemes)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_concurrency = max_concurrency or self.max_workers
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.queue_time_total = 0.0
+        self.queue_time_max = 0.0
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(_verify, self.schemes, plain_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash, self.schemes, password)
+
+    def stats(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "max_concurrency": self.max_concurrency,
+            "waiting": self.waiting,
+            "running": self.running,
+            "completed": self.completed,
+            "queue_time_avg": self.queue_time_total / self.completed if self.completed else 0.0,
+            "queue_time_max": self.queue_time_max,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _run(self, func, *args):
+        queued_at = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        queue_time = time.perf_counter() - queued_at
+        self.queue_time_total += queue_time
+        self.queue_time_max = max(self.queue_time_max, queue_time)
+        self.running += 1
+        try:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self.running -= 1
+            self.completed += 1
+            self._slots.release()
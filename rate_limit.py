@@ -0,0 +1,160 @@
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.security import OAuth2PasswordRequestForm
+
+
+def refill(tokens: float, updated: float, now: float, capacity: float, per_second: float) -> Tuple[float, float]:
+    # Take one token from a bucket last seen holding `tokens` at `updated`.
+    # Returns what is left and 0, or the unchanged level and how long until
+    # a whole token is back.
+    tokens = min(capacity, tokens + (now - updated) * per_second)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / per_second
+
+
+class MemoryBuckets:
+    # Per-process buckets: (tokens, updated) per key, least recently used
+    # keys dropped first once max_keys is reached. A dropped bucket comes
+    # back full, which is what an idle one would have refilled to anyway.
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: float, per_second: float) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens, wait = refill(tokens, updated, now, capacity, per_second)
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class SQLiteBuckets:
+    # Shared by every worker on the host through one SQLite file, so a client
+    # cannot multiply its budget by the number of workers. Put the file on a
+    # tmpfs such as /dev/shm and it never touches the disk. Each take is one
+    # short write transaction; least recently used keys are evicted every
+    # evict_every takes.
+    def __init__(self, path: str, max_keys: int = 100000, evict_every: int = 100):
+        self.max_keys = max_keys
+        self.evict_every = evict_every
+        self._takes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=wal")
+        self._conn.execute("PRAGMA synchronous=off")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS buckets_updated ON buckets (updated)")
+
+    def take(self, key: str, capacity: float, per_second: float) -> float:
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, so two workers cannot
+            # both spend the last token.
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = self._conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+                tokens, updated = row if row is not None else (capacity, now)
+                tokens, wait = refill(tokens, updated, now, capacity, per_second)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, now)
+                )
+                self._takes += 1
+                if self._takes % self.evict_every == 0:
+                    self._evict()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            return wait
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM buckets").fetchone()[0]
+
+    def _evict(self):
+        excess = self._conn.execute("SELECT COUNT(*) FROM buckets").fetchone()[0] - self.max_keys
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM buckets WHERE key IN (SELECT key FROM buckets ORDER BY updated LIMIT ?)", (excess,)
+            )
+
+
+class TokenBucket:
+    # Up to `capacity` attempts at once per key, refilled at per_second. The
+    # name prefixes the keys, so several limits can share one backend.
+    def __init__(self, name: str, capacity: float, per_second: float, backend=None):
+        self.name = name
+        self.capacity = capacity
+        self.per_second = per_second
+        self.backend = backend if backend is not None else MemoryBuckets()
+        self.allowed = 0
+        self.rejected = 0
+
+    def take(self, key: str) -> float:
+        wait = self.backend.take(f"{self.name}:{key}", self.capacity, self.per_second)
+        if wait:
+            self.rejected += 1
+        else:
+            self.allowed += 1
+        return wait
+
+    def stats(self) -> dict:
+        return {"allowed": self.allowed, "rejected": self.rejected}
+
+
+class LoginRateLimit:
+    # Dependency for the /token endpoints. It runs before the endpoint, so a
+    # rejected attempt costs a dict or SQLite lookup instead of a password
+    # verification. The client address is checked first: one address trying
+    # many usernames is stopped without touching their buckets. In-memory
+    # buckets are checked on the event loop; a shared SQLite file may have to
+    # wait for another worker's write, so those checks go to the threadpool.
+    def __init__(self, per_username: TokenBucket, per_ip: Optional[TokenBucket] = None):
+        self.per_username = per_username
+        self.per_ip = per_ip
+
+    async def __call__(self, request: Request, form_data: OAuth2PasswordRequestForm = Depends()):
+        host = request.client.host if request.client is not None else None
+        if self._blocking():
+            wait = await run_in_threadpool(self.check, host, form_data.username)
+        else:
+            wait = self.check(host, form_data.username)
+        if wait:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many login attempts",
+                headers={"Retry-After": str(math.ceil(wait))},
+            )
+
+    def check(self, host: Optional[str], username: str) -> float:
+        if self.per_ip is not None and host is not None:
+            wait = self.per_ip.take(host)
+            if wait:
+                return wait
+        return self.per_username.take(username)
+
+    def stats(self) -> dict:
+        stats = {"username": self.per_username.stats()}
+        if self.per_ip is not None:
+            stats["ip"] = self.per_ip.stats()
+        return stats
+
+    def _blocking(self) -> bool:
+        buckets = [self.per_username] + ([self.per_ip] if self.per_ip is not None else [])
+        return any(isinstance(bucket.backend, SQLiteBuckets) for bucket in buckets)
@@ -0,0 +1,124 @@
+import hashlib
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+def session_key(session_id: str) -> str:
+    # Stores only see a hash of the session id, so reading a store (or a
+    # backup of the shared file) does not hand out working tokens.
+    return hashlib.sha256(session_id.encode()).hexdigest()
+
+
+def new_session_id() -> str:
+    return secrets.token_urlsafe(32)
+
+
+class MemorySessionStore:
+    # Per-process sessions with sliding expiry: every lookup pushes the
+    # session ttl seconds into the future. Since the ttl is the same for all
+    # of them, least recently used is also soonest to expire, so one
+    # OrderedDict gives O(1) lookup, renewal, revocation and eviction of
+    # expired sessions from its front.
+    def __init__(self, ttl: float, max_entries: int = 100000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._sessions: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, username: str) -> str:
+        session_id = new_session_id()
+        with self._lock:
+            self._sessions[session_key(session_id)] = (time.monotonic() + self.ttl, username)
+            self._evict()
+        return session_id
+
+    def get(self, session_id: str) -> Optional[str]:
+        key = session_key(session_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is None or entry[0] <= now:
+                self._sessions.pop(key, None)
+                self.misses += 1
+                return None
+            self._sessions[key] = (now + self.ttl, entry[1])
+            self._sessions.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def revoke(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_key(session_id), None)
+
+    def stats(self) -> dict:
+        return {"sessions": len(self._sessions), "hits": self.hits, "misses": self.misses}
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._sessions:
+            expires, _ = next(iter(self._sessions.values()))
+            if expires > now and len(self._sessions) <= self.max_entries:
+                break
+            self._sessions.popitem(last=False)
+
+
+class SQLiteSessionStore:
+    # Sessions shared by every worker on the host through one SQLite file
+    # (WAL mode, ideally on /dev/shm), so a token issued by one worker works
+    # on all of them and a revocation takes effect everywhere. Renewals are
+    # only written once a session's expiry has moved by more than
+    # touch_interval seconds, so most lookups are a single indexed read.
+    def __init__(self, path: str, ttl: float, touch_interval: float = 10.0, evict_every: int = 100):
+        self.ttl = ttl
+        self.touch_interval = touch_interval
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._creates = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=wal")
+        self._conn.execute("PRAGMA synchronous=off")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS sessions (key TEXT PRIMARY KEY, username TEXT, expires REAL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires)")
+
+    def create(self, username: str) -> str:
+        session_id = new_session_id()
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO sessions (key, username, expires) VALUES (?, ?, ?)",
+                (session_key(session_id), username, now + self.ttl),
+            )
+            self._creates += 1
+            if self._creates % self.evict_every == 0:
+                self._conn.execute("DELETE FROM sessions WHERE expires <= ?", (now,))
+        return session_id
+
+    def get(self, session_id: str) -> Optional[str]:
+        key = session_key(session_id)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT username, expires FROM sessions WHERE key = ?", (key,)).fetchone()
+            if row is None or row[1] <= now:
+                self.misses += 1
+                return None
+            if now + self.ttl - row[1] > self.touch_interval:
+                self._conn.execute("UPDATE sessions SET expires = ? WHERE key = ?", (now + self.ttl, key))
+            self.hits += 1
+            return row[0]
+
+    def revoke(self, session_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE key = ?", (session_key(session_id),))
+
+    def stats(self) -> dict:
+        with self._lock:
+            sessions = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        return {"sessions": sessions, "hits": self.hits, "misses": self.misses}
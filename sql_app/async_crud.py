@@ -0,0 +1,96 @@
+from typing import List, Optional, Set
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from . import models, schemas
+from .crud import BULK_BATCH_SIZE, insert_batches
+
+# schemas.User serializes User.items, and lazy loading is not available on
+# an AsyncSession, so every user query loads the items up front.
+users_with_items = select(models.User).options(selectinload(models.User.items))
+
+
+async def get_user(db: AsyncSession, user_id: int):
+    result = await db.execute(users_with_items.filter(models.User.id == user_id))
+    return result.scalars().first()
+
+
+async def get_user_by_email(db: AsyncSession, email: str):
+    result = await db.execute(users_with_items.filter(models.User.email == email))
+    return result.scalars().first()
+
+
+async def get_users(db: AsyncSession, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    query = users_with_items.order_by(models.User.id)
+    if after_id is not None:
+        query = query.filter(models.User.id > after_id)
+    else:
+        query = query.offset(skip)
+    result = await db.execute(query.limit(limit))
+    return result.scalars().all()
+
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate):
+    fake_hashed_password = user.password + "notreallyhashed"
+    db_user = models.User(email=user.email,
+                          hashed_password=fake_hashed_password, items=[])
+    db.add(db_user)
+    await db.commit()
+    await db.refresh(db_user, ["id", "is_active"])
+    return db_user
+
+
+async def get_registered_emails(db: AsyncSession, emails: List[str]) -> Set[str]:
+    registered = set()
+    for start in range(0, len(emails), BULK_BATCH_SIZE):
+        chunk = emails[start:start + BULK_BATCH_SIZE]
+        result = await db.execute(select(models.User.email).filter(models.User.email.in_(chunk)))
+        registered.update(result.scalars())
+    return registered
+
+
+async def create_users(db: AsyncSession, users: List[schemas.UserCreate]) -> List[int]:
+    rows = [
+        {"email": user.email, "hashed_password": user.password + "notreallyhashed"}
+        for user in users
+    ]
+    return await insert_many(db, models.User, rows)
+
+
+async def get_items(db: AsyncSession, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    query = select(models.Item).order_by(models.Item.id)
+    if after_id is not None:
+        query = query.filter(models.Item.id > after_id)
+    else:
+        query = query.offset(skip)
+    result = await db.execute(query.limit(limit))
+    return result.scalars().all()
+
+
+async def create_user_item(db: AsyncSession, item: schemas.ItemCreate, user_id: int):
+    db_item = models.Item(**item.dict(), owner_id=user_id)
+    db.add(db_item)
+    await db.commit()
+    await db.refresh(db_item)
+    return db_item
+
+
+async def create_user_items(db: AsyncSession, items: List[schemas.ItemCreate], user_id: int) -> List[int]:
+    rows = [{**item.dict(), "owner_id": user_id} for item in items]
+    return await insert_many(db, models.Item, rows)
+
+
+async def insert_many(db: AsyncSession, model, rows: List[dict]) -> List[int]:
+    # One transaction; ids[i] is the id of rows[i].
+    ids = []
+    try:
+        for statement, parameters, unordered in insert_batches(db.get_bind().dialect, model, rows):
+            batch = (await db.execute(statement, parameters)).scalars().all()
+            ids += sorted(batch) if unordered else batch
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    return ids
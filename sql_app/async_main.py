@@ -0,0 +1,87 @@
+from typing import List, Optional
+
+from fastapi import Depends, FastAPI, HTTPException, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from pagination import decode_cursor, set_next_cursor
+from . import async_crud as crud, models, schemas
+from .async_database import SessionLocal, engine
+
+app = FastAPI()
+
+
+@app.on_event("startup")
+async def startup():
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await engine.dispose()
+
+
+# Dependency
+async def get_db():
+    async with SessionLocal() as db:
+        yield db
+
+
+@app.post("/users/", response_model=schemas.User)
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
+    db_user = await crud.get_user_by_email(db, email=user.email)
+    if db_user:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    return await crud.create_user(db=db, user=user)
+
+
+@app.post("/users/bulk", response_model=List[int])
+async def create_users_bulk(users: List[schemas.UserCreate], db: AsyncSession = Depends(get_db)):
+    emails = [user.email for user in users]
+    if len(set(emails)) != len(emails) or await crud.get_registered_emails(db, emails):
+        raise HTTPException(status_code=400, detail="Email already registered")
+    return await crud.create_users(db=db, users=users)
+
+
+@app.get("/users/", response_model=List[schemas.User])
+async def read_users(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    users = await crud.get_users(db, skip=skip, limit=limit, after_id=decode_cursor(cursor))
+    set_next_cursor(response, users, limit)
+    return users
+
+
+@app.get("/users/{user_id}", response_model=schemas.User)
+async def read_user(user_id: int, db: AsyncSession = Depends(get_db)):
+    db_user = await crud.get_user(db, user_id=user_id)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return db_user
+
+
+@app.post("/users/{user_id}/items/", response_model=schemas.Item)
+async def create_item_for_user(user_id: int, item: schemas.ItemCreate, db: AsyncSession = Depends(get_db)):
+    return await crud.create_user_item(db=db, item=item, user_id=user_id)
+
+
+@app.post("/users/{user_id}/items/bulk", response_model=List[int])
+async def create_items_for_user_bulk(user_id: int, items: List[schemas.ItemCreate], db: AsyncSession = Depends(get_db)):
+    return await crud.create_user_items(db=db, items=items, user_id=user_id)
+
+
+@app.get("/items/", response_model=List[schemas.Item])
+async def read_items(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    items = await crud.get_items(db, skip=skip, limit=limit, after_id=decode_cursor(cursor))
+    set_next_cursor(response, items, limit)
+    return items
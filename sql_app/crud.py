@@ -1,17 +1,134 @@
-from sqlalchemy.orm import Session
+import os
+from typing import List, Optional, Set, Tuple
+
+from sqlalchemy import bindparam, insert, select
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy.sql import Executable
+from sqlalchemy.sql.compiler import InsertmanyvaluesSentinelOpts
+
+from cache import MemoryBackend, ReadThroughCache, SQLiteBackend
 from . import models, schemas
+from .streaming import encode_row
+
+# Rows per multi-row INSERT; keeps the bound parameter count well below the
+# limits of SQLite (32766) and PostgreSQL (65535).
+BULK_BATCH_SIZE = 1000
+
+# How User.items is loaded with the users: None leaves it lazy (one SELECT
+# per user on first access), "selectin" adds one SELECT ... WHERE owner_id IN
+# for the whole page, "joined" LEFT OUTER JOINs items into the user query.
+ITEMS_LOADERS = {"selectin": selectinload, "joined": joinedload}
+
+# Users as returned by the API, keyed by "user:<id>", plus "user-email:<email>"
+# entries that point at the id. With USER_CACHE_PATH set, all workers share
+# one SQLite file; otherwise each process caches on its own.
+USER_CACHE_PATH = os.getenv("USER_CACHE_PATH")
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+user_cache = ReadThroughCache(
+    SQLiteBackend(USER_CACHE_PATH, USER_CACHE_SIZE) if USER_CACHE_PATH else MemoryBackend(USER_CACHE_SIZE),
+    ttl=float(os.getenv("USER_CACHE_TTL", "60")),
+)
+
+
+def select_users(items: Optional[str] = None):
+    statement = select(models.User)
+    if items is not None:
+        statement = statement.options(ITEMS_LOADERS[items](models.User.items))
+    return statement
+
+
+# The read statements are built once, with bound parameters for every value,
+# and reused for each call. Besides skipping the construction, SQLAlchemy
+# memoizes the cache key on a statement object, so executing the same object
+# again goes straight to the already compiled SQL. Keyed by items loader.
+USER_BY_ID = {
+    items: select_users(items).where(models.User.id == bindparam("user_id"))
+    for items in (None, *ITEMS_LOADERS)
+}
+USER_BY_EMAIL = {
+    items: select_users(items).where(models.User.email == bindparam("email"))
+    for items in (None, *ITEMS_LOADERS)
+}
+USERS_BY_OFFSET = {
+    items: select_users(items).order_by(models.User.id).offset(bindparam("skip")).limit(bindparam("limit"))
+    for items in (None, *ITEMS_LOADERS)
+}
+USERS_AFTER_ID = {
+    items: select_users(items)
+    .where(models.User.id > bindparam("after_id"))
+    .order_by(models.User.id)
+    .limit(bindparam("limit"))
+    for items in (None, *ITEMS_LOADERS)
+}
+ITEMS_BY_OFFSET = select(models.Item).order_by(models.Item.id).offset(bindparam("skip")).limit(bindparam("limit"))
+ITEMS_AFTER_ID = (
+    select(models.Item)
+    .where(models.Item.id > bindparam("after_id"))
+    .order_by(models.Item.id)
+    .limit(bindparam("limit"))
+)
+
+
+def get_user(db: Session, user_id: int, items: Optional[str] = None):
+    return db.execute(USER_BY_ID[items], {"user_id": user_id}).unique().scalars().first()
+
+
+def get_user_by_email(db: Session, email: str, items: Optional[str] = None):
+    return db.execute(USER_BY_EMAIL[items], {"email": email}).unique().scalars().first()
 
 
-def get_user(db: Session, user_id: int):
-    return db.query(models.User).filter(models.User.id == user_id).first()
+def fetch_rows(db: Session, statement, params: dict, yield_per: Optional[int] = None):
+    # With yield_per the rows come back as an iterator that pulls yield_per
+    # rows at a time from the cursor instead of one fully built list.
+    # unique() is what Query did implicitly for joined eager loads.
+    if yield_per:
+        return db.execute(statement, params, execution_options={"yield_per": yield_per}).scalars()
+    return db.execute(statement, params).unique().scalars().all()
 
 
-def get_user_by_email(db: Session, email: str):
-    return db.query(models.User).filter(models.User.email == email).first()
+def get_cached_user(db: Session, user_id: int, items: Optional[str] = None) -> Optional[schemas.User]:
+    # Only primary reads fill the cache: a lagging replica would put back the
+    # entry a write has just invalidated. Read-your-writes requests skip the
+    # cache altogether and see the primary as it is now.
+    def load():
+        db_user = get_user(db, user_id, items)
+        return None if db_user is None else encode_row(db_user, schemas.User)
 
+    if db.info.get("read_your_writes"):
+        data = load()
+    elif db.info.get("replica"):
+        data = user_cache.get(f"user:{user_id}") or load()
+    else:
+        data = user_cache.get_or_load(f"user:{user_id}", load)
+    return None if data is None else schemas.User.parse_raw(data)
 
-def get_users(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.User).offset(skip).limit(limit).all()
+
+def get_cached_user_by_email(db: Session, email: str, items: Optional[str] = None) -> Optional[schemas.User]:
+    if not db.info.get("read_your_writes"):
+        user_id = user_cache.get(f"user-email:{email}")
+        if user_id is not None:
+            return get_cached_user(db, int(user_id), items)
+    db_user = get_user_by_email(db, email, items)
+    if db_user is None:
+        return None
+    data = encode_row(db_user, schemas.User)
+    if not db.info.get("replica"):
+        user_cache.set(f"user:{db_user.id}", data)
+        user_cache.set(f"user-email:{email}", str(db_user.id))
+    return schemas.User.parse_raw(data)
+
+
+def get_users(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    after_id: Optional[int] = None,
+    items: Optional[str] = None,
+    yield_per: Optional[int] = None,
+):
+    if after_id is not None:
+        return fetch_rows(db, USERS_AFTER_ID[items], {"after_id": after_id, "limit": limit}, yield_per)
+    return fetch_rows(db, USERS_BY_OFFSET[items], {"skip": skip, "limit": limit}, yield_per)
 
 
 def create_user(db: Session, user: schemas.UserCreate):
@@ -20,17 +137,89 @@ def create_user(db: Session, user: schemas.UserCreate):
                           hashed_password=fake_hashed_password)
     db.add(db_user)
     db.commit()
+    user_cache.invalidate(f"user-email:{user.email}")
     db.refresh(db_user)
     return db_user
 
 
-def get_items(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Item).offset(skip).limit(limit).all()
+def get_registered_emails(db: Session, emails: List[str]) -> Set[str]:
+    registered = set()
+    for start in range(0, len(emails), BULK_BATCH_SIZE):
+        chunk = emails[start:start + BULK_BATCH_SIZE]
+        registered.update(email for email, in db.query(models.User.email).filter(models.User.email.in_(chunk)))
+    return registered
+
+
+def create_users(db: Session, users: List[schemas.UserCreate]) -> List[int]:
+    rows = [
+        {"email": user.email, "hashed_password": user.password + "notreallyhashed"}
+        for user in users
+    ]
+    return insert_many(db, models.User, rows)
+
+
+def get_items(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    after_id: Optional[int] = None,
+    yield_per: Optional[int] = None,
+):
+    if after_id is not None:
+        return fetch_rows(db, ITEMS_AFTER_ID, {"after_id": after_id, "limit": limit}, yield_per)
+    return fetch_rows(db, ITEMS_BY_OFFSET, {"skip": skip, "limit": limit}, yield_per)
 
 
 def create_user_item(db: Session, item: schemas.ItemCreate, user_id: int):
     db_item = models.Item(**item.dict(), owner_id=user_id)
     db.add(db_item)
     db.commit()
+    user_cache.invalidate(f"user:{user_id}")
     db.refresh(db_item)
     return db_item
+
+
+def create_user_items(db: Session, items: List[schemas.ItemCreate], user_id: int) -> List[int]:
+    rows = [{**item.dict(), "owner_id": user_id} for item in items]
+    ids = insert_many(db, models.Item, rows)
+    user_cache.invalidate(f"user:{user_id}")
+    return ids
+
+
+def insert_many(db: Session, model, rows: List[dict]) -> List[int]:
+    # One transaction; ids[i] is the id of rows[i].
+    ids = []
+    try:
+        for statement, parameters, unordered in insert_batches(db.get_bind().dialect, model, rows):
+            batch = db.execute(statement, parameters).scalars().all()
+            ids += sorted(batch) if unordered else batch
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return ids
+
+
+def insert_batches(dialect, model, rows: List[dict]) -> List[Tuple[Executable, Optional[List[dict]], bool]]:
+    # (statement, parameters, unordered) for inserting rows BULK_BATCH_SIZE at
+    # a time with INSERT ... VALUES (...), (...) RETURNING id. RETURNING does
+    # not promise VALUES order, so where the dialect can batch with an
+    # ordering sentinel (PostgreSQL) sort_by_parameter_order matches the ids
+    # back to rows. SQLite cannot, and SQLAlchemy would fall back to one
+    # INSERT per row; there each batch is one statement whose ids are sorted
+    # afterwards, which is their VALUES order since SQLite hands out rowids
+    # in insertion order.
+    if not rows:
+        return []
+    if dialect.insertmanyvalues_implicit_sentinel & InsertmanyvaluesSentinelOpts.ANY_AUTOINCREMENT:
+        statement = (
+            insert(model)
+            .returning(model.id, sort_by_parameter_order=True)
+            .execution_options(insertmanyvalues_page_size=BULK_BATCH_SIZE)
+        )
+        return [(statement, rows, False)]
+    table = model.__table__
+    return [
+        (table.insert().values(rows[start:start + BULK_BATCH_SIZE]).returning(table.c.id), None, True)
+        for start in range(0, len(rows), BULK_BATCH_SIZE)
+    ]
@@ -1,29 +1,50 @@
-from typing import List
+import os
+import time
+from typing import List, Optional
 
-from fastapi import Depends, FastAPI, HTTPException, Request, Response
+from fastapi import Cookie, Depends, FastAPI, Header, HTTPException, Request, Response
 from sqlalchemy.orm import Session
 
-from . import crud, models, schemas
-from .database import SessionLocal, engine
+from pagination import decode_cursor, set_next_cursor
+from . import crud, database, models, schemas
+from .streaming import STREAM_CHUNK_SIZE, streaming_media_type, streaming_response
+from .database import CheckoutCounter, SessionLocal, db_checkouts, engine
 
 models.Base.metadata.create_all(bind=engine)
 
+# schemas.User includes the user's items, so endpoints returning it load them
+# together with the users ("selectin" or "joined") instead of lazily per user.
+USER_ITEMS_LOADING = "selectin"
+
+# After a write, the client's reads stay on the primary for this many
+# seconds, so it sees its own changes however far the replicas lag behind.
+READ_YOUR_WRITES_SECONDS = int(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+PRIMARY_COOKIE = "db-primary-until"
+
 app = FastAPI()
 
 
 @app.middleware("http")
-async def db_session_middleware(request: Request, call_next):
-    response = Response("Internal server error", status_code=500)
+async def count_db_checkouts(request: Request, call_next):
+    # Sessions come from get_db only, so requests that never ask for one
+    # (404s, docs) check nothing out of the pool. The header makes a second
+    # checkout per request easy to spot.
+    counter = CheckoutCounter()
+    token = db_checkouts.set(counter)
     try:
-        request.state.db = SessionLocal()
         response = await call_next(request)
     finally:
-        request.state.db.close()
+        db_checkouts.reset(token)
+    response.headers["X-DB-Checkouts"] = str(counter.checkouts)
     return response
 
 
-# Dependency
-def get_db():
+# Dependency; FastAPI caches it per request, so every dependency that asks
+# for a session gets this same one. Always on the primary.
+def get_db(response: Response):
+    if database.replicas is not None:
+        primary_until = time.time() + READ_YOUR_WRITES_SECONDS
+        response.set_cookie(PRIMARY_COOKIE, str(primary_until), max_age=READ_YOUR_WRITES_SECONDS)
     db = SessionLocal()
     try:
         yield db
@@ -31,23 +52,67 @@ def get_db():
         db.close()
 
 
+# Dependency for read-only endpoints: a replica session, unless this client
+# wrote something within the last READ_YOUR_WRITES_SECONDS.
+def get_read_db(primary_until: Optional[str] = Cookie(None, alias=PRIMARY_COOKIE)):
+    try:
+        use_primary = primary_until is not None and float(primary_until) > time.time()
+    except ValueError:
+        use_primary = False
+    db = database.read_session(use_primary=use_primary)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
 @app.post("/users/", response_model=schemas.User)
 def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_email(db, email=user.email)
+    db_user = crud.get_cached_user_by_email(db, email=user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     return crud.create_user(db=db, user=user)
 
 
+@app.post("/users/bulk", response_model=List[int])
+def create_users_bulk(users: List[schemas.UserCreate], db: Session = Depends(get_db)):
+    emails = [user.email for user in users]
+    if len(set(emails)) != len(emails) or crud.get_registered_emails(db, emails):
+        raise HTTPException(status_code=400, detail="Email already registered")
+    return crud.create_users(db=db, users=users)
+
+
 @app.get("/users/", response_model=List[schemas.User])
-def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    users = crud.get_users(db, skip=skip, limit=limit)
+def read_users(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    accept: Optional[str] = Header(None),
+    db: Session = Depends(get_read_db),
+):
+    media_type = streaming_media_type(accept, stream)
+    if media_type:
+        users = crud.get_users(
+            db,
+            skip=skip,
+            limit=limit,
+            after_id=decode_cursor(cursor),
+            items=USER_ITEMS_LOADING,
+            yield_per=STREAM_CHUNK_SIZE,
+        )
+        return streaming_response(users, schemas.User, media_type)
+    users = crud.get_users(
+        db, skip=skip, limit=limit, after_id=decode_cursor(cursor), items=USER_ITEMS_LOADING
+    )
+    set_next_cursor(response, users, limit)
     return users
 
 
 @app.get("/users/{user_id}", response_model=schemas.User)
-def read_user(user_id: int, db: Session = Depends(get_db)):
-    db_user = crud.get_user(db, user_id=user_id)
+def read_user(user_id: int, db: Session = Depends(get_read_db)):
+    db_user = crud.get_cached_user(db, user_id=user_id, items=USER_ITEMS_LOADING)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return db_user
@@ -58,7 +123,32 @@ def create_item_for_user(user_id: int, item: schemas.ItemCreate, db: Session = D
     return crud.create_user_item(db=db, item=item, user_id=user_id)
 
 
+@app.post("/users/{user_id}/items/bulk", response_model=List[int])
+def create_items_for_user_bulk(user_id: int, items: List[schemas.ItemCreate], db: Session = Depends(get_db)):
+    return crud.create_user_items(db=db, items=items, user_id=user_id)
+
+
 @app.get("/items/", response_model=List[schemas.Item])
-def read_items(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    items = crud.get_items(db, skip=skip, limit=limit)
+def read_items(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    accept: Optional[str] = Header(None),
+    db: Session = Depends(get_read_db),
+):
+    media_type = streaming_media_type(accept, stream)
+    if media_type:
+        items = crud.get_items(
+            db, skip=skip, limit=limit, after_id=decode_cursor(cursor), yield_per=STREAM_CHUNK_SIZE
+        )
+        return streaming_response(items, schemas.Item, media_type)
+    items = crud.get_items(db, skip=skip, limit=limit, after_id=decode_cursor(cursor))
+    set_next_cursor(response, items, limit)
     return items
+
+
+@app.get("/cache/stats")
+def read_cache_stats():
+    return crud.user_cache.stats()
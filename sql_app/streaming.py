@@ -0,0 +1,55 @@
+from typing import Iterable, Iterator, Optional, Type
+
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+JSON_MEDIA_TYPE = "application/json"
+# Rows fetched per round trip from the database cursor, and rows encoded into
+# each chunk written to the client.
+STREAM_CHUNK_SIZE = 1000
+
+
+def streaming_media_type(accept: Optional[str], stream: bool) -> Optional[str]:
+    # Accept: application/x-ndjson streams one object per line; ?stream=true
+    # streams the same JSON array the buffered response would have returned.
+    if accept and NDJSON_MEDIA_TYPE in accept:
+        return NDJSON_MEDIA_TYPE
+    if stream:
+        return JSON_MEDIA_TYPE
+    return None
+
+
+def encode_row(row, schema: Type[BaseModel]) -> str:
+    # The schemas use pydantic 1's orm_mode, which pydantic 2 no longer reads
+    # for model_validate, so ask for attribute access explicitly there.
+    if hasattr(schema, "model_validate"):
+        return schema.model_validate(row, from_attributes=True).model_dump_json()
+    return schema.from_orm(row).json()
+
+
+def encode_rows(rows: Iterable, schema: Type[BaseModel], media_type: str) -> Iterator[str]:
+    ndjson = media_type == NDJSON_MEDIA_TYPE
+    chunk = [] if ndjson else ["["]
+    separator = ""
+    for row in rows:
+        body = encode_row(row, schema)
+        if ndjson:
+            chunk.append(body + "\n")
+        else:
+            chunk.append(separator + body)
+            separator = ","
+        if len(chunk) >= STREAM_CHUNK_SIZE:
+            yield "".join(chunk)
+            chunk = []
+    if not ndjson:
+        chunk.append("]")
+    if chunk:
+        yield "".join(chunk)
+
+
+def streaming_response(rows: Iterable, schema: Type[BaseModel], media_type: str) -> StreamingResponse:
+    # Each row is validated and encoded on its own, so memory stays flat no
+    # matter how many rows the query returns. Pagination headers are not set:
+    # the last id is only known once the body has been sent.
+    return StreamingResponse(encode_rows(rows, schema, media_type), media_type=media_type)
@@ -1,4 +1,32 @@
-from . import models, schemas
+import os
+from typing import List, Optional, Set
+
+import peewee
+
+from cache import MemoryBackend, ReadThroughCache, SQLiteBackend
+from . import database, models, schemas
+
+# Rows per multi-row INSERT; keeps the bound parameter count well below the
+# SQLite limit (32766).
+BULK_BATCH_SIZE = 1000
+
+# Users as returned by the API, keyed by "user:<id>", plus "user-email:<email>"
+# entries that point at the id. With USER_CACHE_PATH set, all workers share
+# one SQLite file; otherwise each process caches on its own.
+USER_CACHE_PATH = os.getenv("USER_CACHE_PATH")
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+user_cache = ReadThroughCache(
+    SQLiteBackend(USER_CACHE_PATH, USER_CACHE_SIZE) if USER_CACHE_PATH else MemoryBackend(USER_CACHE_SIZE),
+    ttl=float(os.getenv("USER_CACHE_TTL", "60")),
+)
+
+
+def encode_user(db_user: models.User) -> str:
+    # pydantic 2 no longer reads orm_mode/getter_dict, so ask for attribute
+    # access explicitly there.
+    if hasattr(schemas.User, "model_validate"):
+        return schemas.User.model_validate(db_user, from_attributes=True).model_dump_json()
+    return schemas.User.from_orm(db_user).json()
 
 
 def get_user(user_id: int):
@@ -9,22 +37,92 @@ def get_user_by_email(email: str):
     return models.User.filter(models.User.email == email).first()
 
 
-def get_users(skip: int = 0, limit: int = 100):
-    return list(models.User.select().offset(skip).limit(limit))
+def get_cached_user(user_id: int) -> Optional[schemas.User]:
+    def load():
+        db_user = get_user(user_id)
+        return None if db_user is None else encode_user(db_user)
+
+    data = user_cache.get_or_load(f"user:{user_id}", load)
+    return None if data is None else schemas.User.parse_raw(data)
+
+
+def get_cached_user_by_email(email: str) -> Optional[schemas.User]:
+    user_id = user_cache.get(f"user-email:{email}")
+    if user_id is not None:
+        return get_cached_user(int(user_id))
+    db_user = get_user_by_email(email)
+    if db_user is None:
+        return None
+    data = encode_user(db_user)
+    user_cache.set(f"user:{db_user.id}", data)
+    user_cache.set(f"user-email:{email}", str(db_user.id))
+    return schemas.User.parse_raw(data)
+
+
+def get_users(skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    query = models.User.select().order_by(models.User.id)
+    if after_id is not None:
+        query = query.where(models.User.id > after_id)
+    else:
+        query = query.offset(skip)
+    return list(query.limit(limit))
 
 
 def create_user(user: schemas.UserCreate):
     fake_hashed_password = user.password + "notreallyhashed"
     db_user = models.User(email=user.email, hashed_password=fake_hashed_password)
     db_user.save()
+    user_cache.invalidate(f"user-email:{user.email}")
     return db_user
 
 
-def get_items(skip: int = 0, limit: int = 100):
-    return list(models.Item.select().offset(skip).limit(limit))
+def get_registered_emails(emails: List[str]) -> Set[str]:
+    registered = set()
+    for chunk in peewee.chunked(emails, BULK_BATCH_SIZE):
+        query = models.User.select(models.User.email).where(models.User.email.in_(chunk))
+        registered.update(email for email, in query.tuples())
+    return registered
+
+
+def create_users(users: List[schemas.UserCreate]) -> List[int]:
+    rows = [
+        {"email": user.email, "hashed_password": user.password + "notreallyhashed"}
+        for user in users
+    ]
+    return insert_many(models.User, rows)
+
+
+def get_items(skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    query = models.Item.select().order_by(models.Item.id)
+    if after_id is not None:
+        query = query.where(models.Item.id > after_id)
+    else:
+        query = query.offset(skip)
+    return list(query.limit(limit))
 
 
 def create_user_item(item: schemas.ItemCreate, user_id: int):
     db_item = models.Item(**item.dict(), owner_id=user_id)
     db_item.save()
+    user_cache.invalidate(f"user:{user_id}")
     return db_item
+
+
+def create_user_items(items: List[schemas.ItemCreate], user_id: int) -> List[int]:
+    rows = [{**item.dict(), "owner": user_id} for item in items]
+    ids = insert_many(models.Item, rows)
+    user_cache.invalidate(f"user:{user_id}")
+    return ids
+
+
+def insert_many(model, rows: List[dict]) -> List[int]:
+    # One transaction, one INSERT ... VALUES (...), (...) RETURNING id per
+    # batch. RETURNING does not promise VALUES order, but ids are handed out
+    # in insertion order (SQLite rowids, PostgreSQL sequences), so sorting
+    # each batch's ids lines them up with its rows: ids[i] is rows[i]'s id.
+    ids = []
+    with database.db.atomic():
+        for chunk in peewee.chunked(rows, BULK_BATCH_SIZE):
+            query = model.insert_many(chunk).returning(model.id)
+            ids += sorted(row_id for row_id, in query.tuples().execute())
+    return ids
@@ -1,8 +1,13 @@
+import os
 from contextvars import ContextVar
 
 import peewee
+from playhouse.pool import PooledSqliteDatabase
 
-DATABASE_NAME = "test.db"
+DATABASE_NAME = os.getenv("PEEWEE_DATABASE_NAME", "test.db")
+# Above zero, requests borrow one of this many long-lived SQLite connections
+# (in WAL mode) instead of opening and closing a new one each time.
+DATABASE_POOL_SIZE = int(os.getenv("PEEWEE_POOL_SIZE", "0"))
 
 db_state_default = {"closed": None, "conn": None, "ctx": None, "transactions": None}
 db_state = ContextVar("db_state", default=db_state_default.copy())
@@ -20,6 +25,15 @@ class PeeweeConnectionState(peewee._ConnectionState):
         return self._state.get()[name]
 
 
-db = peewee.SqliteDatabase(DATABASE_NAME, check_same_thread=False)
+if DATABASE_POOL_SIZE:
+    db = PooledSqliteDatabase(
+        DATABASE_NAME,
+        max_connections=DATABASE_POOL_SIZE,
+        stale_timeout=300,
+        check_same_thread=False,
+        pragmas={"journal_mode": "wal"},
+    )
+else:
+    db = peewee.SqliteDatabase(DATABASE_NAME, check_same_thread=False)
 
 db._state = PeeweeConnectionState()
@@ -0,0 +1,104 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, ContextManager, Optional
+
+from fastapi import HTTPException
+from fastapi.routing import APIRoute
+
+
+class BoundedExecutor:
+    # A thread pool of its own for slow sync routes, so they queue up here
+    # instead of on the default threadpool shared by every other sync route.
+    # At most max_workers calls run and queue_size wait; anything beyond that
+    # is turned away with a 503 right away.
+    #
+    # resource, if given, is entered on the worker thread around each call
+    # (a DB connection, say). Calls waiting in the queue or turned away hold
+    # nothing, so they cannot starve the routes that need the same resource;
+    # offloaded routes should use it instead of a dependency.
+    def __init__(
+        self,
+        max_workers: int,
+        queue_size: int,
+        retry_after: int = 1,
+        name: str = "bounded",
+        resource: Optional[Callable[[], ContextManager]] = None,
+    ):
+        self.max_workers = max_workers
+        self.queue_size = queue_size
+        self.retry_after = retry_after
+        self.resource = resource
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def offload(self, func: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(func):
+            return func
+
+        # functools.wraps keeps the signature FastAPI reads parameters from.
+        @functools.wraps(func)
+        async def endpoint(*args, **kwargs):
+            self._admit()
+            # Copy the context so the request's peewee connection state (a
+            # ContextVar) is visible in the worker thread.
+            context = contextvars.copy_context()
+            future = self.executor.submit(context.run, self._call, functools.partial(func, *args, **kwargs))
+            future.add_done_callback(self._release)
+            return await asyncio.wrap_future(future)
+
+        return endpoint
+
+    @property
+    def route_class(self):
+        # For APIRouter(route_class=executor.route_class): every sync endpoint
+        # on the router runs on this executor.
+        executor = self
+
+        class OffloadedRoute(APIRoute):
+            def __init__(self, path: str, endpoint: Callable, **kwargs):
+                super().__init__(path, executor.offload(endpoint), **kwargs)
+
+        return OffloadedRoute
+
+    def stats(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "queue_size": self.queue_size,
+            "running": min(self.in_flight, self.max_workers),
+            "queued": max(self.in_flight - self.max_workers, 0),
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+    def _call(self, call: Callable):
+        if self.resource is None:
+            return call()
+        with self.resource():
+            return call()
+
+    def _admit(self):
+        with self._lock:
+            if self.in_flight >= self.max_workers + self.queue_size:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=503,
+                    detail="Server busy",
+                    headers={"Retry-After": str(self.retry_after)},
+                )
+            self.in_flight += 1
+
+    def _release(self, future):
+        # The slot is only given back once the call has actually finished,
+        # even if the client went away and the request was cancelled.
+        with self._lock:
+            self.in_flight -= 1
+            self.completed += 1
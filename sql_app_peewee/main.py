@@ -1,10 +1,16 @@
+import os
+import threading
 import time
-from typing import List
+from contextlib import contextmanager
+from typing import List, Optional
 
-from fastapi import Depends, FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Response
+from fastapi.concurrency import run_in_threadpool
 
+from pagination import decode_cursor, set_next_cursor
 from . import crud, database, models, schemas
 from .database import db_state_default
+from .executors import BoundedExecutor
 
 database.db.connect()
 database.db.create_tables([models.User, models.Item])
@@ -29,23 +35,108 @@ def get_db(db_state=Depends(reset_db_state)):
             database.db.close()
 
 
+# Keeps requests from asking the pool for more connections than it has. A
+# thread semaphore, so requests on the event loop and calls already running
+# on a worker thread (see db_connection) share the one limit.
+pool_slots = threading.BoundedSemaphore(max(database.DATABASE_POOL_SIZE, 1))
+
+
+async def get_pooled_db():
+    # Runs on the event loop, so unlike get_db it costs no threadpool hops
+    # unless every pool slot is taken and it has to wait for one.
+    # connect()/close() only borrow and return a pooled connection.
+    if not pool_slots.acquire(blocking=False):
+        acquired = []
+
+        def wait_for_slot():
+            pool_slots.acquire()
+            acquired.append(True)
+
+        try:
+            await run_in_threadpool(wait_for_slot)
+        except BaseException:
+            # Cancelled, possibly after the thread had already taken a slot.
+            if acquired:
+                pool_slots.release()
+            raise
+    try:
+        database.db._state._state.set(db_state_default.copy())
+        database.db._state.reset()
+        database.db.connect()
+        try:
+            yield
+        finally:
+            if not database.db.is_closed():
+                database.db.close()
+    finally:
+        pool_slots.release()
+
+
+@contextmanager
+def db_connection():
+    # get_db/get_pooled_db for code already on a worker thread.
+    pooled = bool(database.DATABASE_POOL_SIZE)
+    if pooled:
+        pool_slots.acquire()
+    try:
+        database.db._state._state.set(db_state_default.copy())
+        database.db._state.reset()
+        database.db.connect()
+        try:
+            yield
+        finally:
+            if not database.db.is_closed():
+                database.db.close()
+    finally:
+        if pooled:
+            pool_slots.release()
+
+
+if database.DATABASE_POOL_SIZE:
+    app.dependency_overrides[get_db] = get_pooled_db
+
+# /slowusers/ gets its own small pool so its sleeping requests cannot take
+# over the default threadpool the other sync routes run on. Its connection is
+# opened once a request gets a worker, not while it waits in the queue.
+slow_executor = BoundedExecutor(
+    max_workers=int(os.getenv("SLOW_USERS_WORKERS", "4")),
+    queue_size=int(os.getenv("SLOW_USERS_QUEUE_SIZE", "16")),
+    name="slowusers",
+    resource=db_connection,
+)
+
+
+@app.on_event("shutdown")
+def shutdown_executors():
+    slow_executor.shutdown()
+
+
 @app.post("/users/", response_model=schemas.User, dependencies=[Depends(get_db)])
 def create_user(user: schemas.UserCreate):
-    db_user = crud.get_user_by_email(email=user.email)
+    db_user = crud.get_cached_user_by_email(email=user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     return crud.create_user(user=user)
 
 
+@app.post("/users/bulk", response_model=List[int], dependencies=[Depends(get_db)])
+def create_users_bulk(users: List[schemas.UserCreate]):
+    emails = [user.email for user in users]
+    if len(set(emails)) != len(emails) or crud.get_registered_emails(emails):
+        raise HTTPException(status_code=400, detail="Email already registered")
+    return crud.create_users(users=users)
+
+
 @app.get("/users/", response_model=List[schemas.User], dependencies=[Depends(get_db)])
-def read_users(skip: int = 0, limit: int = 100):
-    users = crud.get_users(skip=skip, limit=limit)
+def read_users(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
+    users = crud.get_users(skip=skip, limit=limit, after_id=decode_cursor(cursor))
+    set_next_cursor(response, users, limit)
     return users
 
 
 @app.get("/users/{user_id}", response_model=schemas.User, dependencies=[Depends(get_db)])
 def read_user(user_id: int):
-    db_user = crud.get_user(user_id=user_id)
+    db_user = crud.get_cached_user(user_id=user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return db_user
@@ -60,13 +151,34 @@ def create_item_for_user(user_id: int, item: schemas.ItemCreate):
     return crud.create_user_item(item=item, user_id=user_id)
 
 
+@app.post(
+    "/users/{user_id}/items/bulk",
+    response_model=List[int],
+    dependencies=[Depends(get_db)],
+)
+def create_items_for_user_bulk(user_id: int, items: List[schemas.ItemCreate]):
+    return crud.create_user_items(items=items, user_id=user_id)
+
+
 @app.get("/items/", response_model=List[schemas.Item], dependencies=[Depends(get_db)])
-def read_items(skip: int = 0, limit: int = 100):
-    items = crud.get_items(skip=skip, limit=limit)
+def read_items(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
+    items = crud.get_items(skip=skip, limit=limit, after_id=decode_cursor(cursor))
+    set_next_cursor(response, items, limit)
     return items
 
 
-@app.get("/slowusers/", response_model=List[schemas.User], dependencies=[Depends(get_db)])
+@app.get("/cache/stats")
+def read_cache_stats():
+    return crud.user_cache.stats()
+
+
+@app.get("/slowusers/stats")
+def read_slow_users_stats():
+    return slow_executor.stats()
+
+
+@app.get("/slowusers/", response_model=List[schemas.User])
+@slow_executor.offload
 def read_slow_users(skip: int = 0, limit: int = 100):
     global sleep_time
     sleep_time = max(0, sleep_time - 1)
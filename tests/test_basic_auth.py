@@ -0,0 +1,36 @@
+from fastapi.testclient import TestClient
+
+import main_oauth_basic
+
+
+def test_repeat_credentials_skip_the_kdf():
+    with TestClient(main_oauth_basic.app) as client:
+        stats = lambda: client.get("/auth/stats").json()["basic_auth"]["verifications"]
+        start = stats()
+        for _ in range(3):
+            response = client.get("/users/me", auth=("stanleyjobson", "swordfish"))
+            assert response.json() == {"username": "stanleyjobson"}
+        assert stats() == start + 1
+
+        # Failures are not cached, and unknown users pay for a verification too.
+        assert client.get("/users/me", auth=("stanleyjobson", "sword")).status_code == 401
+        assert client.get("/users/me", auth=("stanleyjobson", "sword")).status_code == 401
+        assert client.get("/users/me", auth=("nobody", "swordfish")).status_code == 401
+        assert stats() == start + 4
+
+
+def test_changed_password_drops_the_cached_check():
+    with TestClient(main_oauth_basic.app) as client:
+        assert client.get("/users/me", auth=("stanleyjobson", "swordfish")).status_code == 200
+
+        backend = main_oauth_basic.users.backend
+        original = backend.users["stanleyjobson"]
+        hashed = client.portal.call(main_oauth_basic.password_hasher.hash, "marlin")
+        backend.put({"username": "stanleyjobson", "hashed_password": hashed})
+        try:
+            client.portal.call(main_oauth_basic.users.refresh)
+            assert client.get("/users/me", auth=("stanleyjobson", "swordfish")).status_code == 401
+            assert client.get("/users/me", auth=("stanleyjobson", "marlin")).status_code == 200
+        finally:
+            backend.put(original)
+            client.portal.call(main_oauth_basic.users.refresh)
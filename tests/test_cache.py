@@ -0,0 +1,57 @@
+import os
+import tempfile
+import time
+
+import pytest
+
+from cache import MemoryBackend, ReadThroughCache, SQLiteBackend
+
+
+def sqlite_backend(**kwargs):
+    return SQLiteBackend(os.path.join(tempfile.mkdtemp(), "cache.db"), **kwargs)
+
+
+@pytest.mark.parametrize("make_backend", [MemoryBackend, sqlite_backend])
+def test_read_through_ttl_and_invalidation(make_backend):
+    cache = ReadThroughCache(make_backend(), ttl=0.2)
+    loads = []
+
+    def load():
+        loads.append(1)
+        return "value"
+
+    assert cache.get_or_load("key", load) == "value"
+    assert cache.get_or_load("key", load) == "value"
+    assert len(loads) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    cache.invalidate("key")
+    cache.get_or_load("key", load)
+    time.sleep(0.25)
+    cache.get_or_load("key", load)
+    assert len(loads) == 3
+
+    assert cache.get_or_load("missing", lambda: None) is None
+    assert cache.get("missing") is None
+
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryBackend(max_entries=2)
+    backend.set("a", "1", 60)
+    backend.set("b", "2", 60)
+    backend.get("a")
+    backend.set("c", "3", 60)
+    assert (backend.get("a"), backend.get("b"), backend.get("c")) == ("1", None, "3")
+
+
+def test_sqlite_backend_is_shared_and_bounded():
+    path = os.path.join(tempfile.mkdtemp(), "cache.db")
+    first, second = SQLiteBackend(path, max_entries=5, evict_every=1), SQLiteBackend(path)
+    first.set("user:1", "cached", 60)
+    assert second.get("user:1") == "cached"
+    second.delete("user:1")
+    assert first.get("user:1") is None
+
+    for i in range(10):
+        first.set(f"key{i}", str(i), 60)
+    assert [first.get(f"key{i}") for i in range(10)] == [None] * 5 + [str(i) for i in range(5, 10)]
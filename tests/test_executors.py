@@ -0,0 +1,90 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from fastapi import APIRouter, FastAPI
+from fastapi.testclient import TestClient
+
+from sql_app_peewee.executors import BoundedExecutor
+
+request_tag = contextvars.ContextVar("request_tag", default=None)
+release = threading.Event()
+started = threading.Semaphore(0)
+
+resources_held = []
+
+
+@contextmanager
+def resource():
+    resources_held.append(threading.current_thread().name)
+    try:
+        yield
+    finally:
+        resources_held.pop()
+
+
+executor = BoundedExecutor(max_workers=1, queue_size=1, resource=resource)
+router = APIRouter(route_class=executor.route_class)
+app = FastAPI()
+
+
+@app.middleware("http")
+async def tag_request(request, call_next):
+    request_tag.set(request.url.path)
+    return await call_next(request)
+
+
+@app.get("/blocking")
+@executor.offload
+def blocking():
+    started.release()
+    release.wait(5)
+    return {"thread": threading.current_thread().name}
+
+
+@router.get("/tagged")
+def tagged(value: int = 0):
+    return {"tag": request_tag.get(), "value": value}
+
+
+app.include_router(router)
+client = TestClient(app)
+
+
+def wait_for(condition, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def test_rejects_with_503_when_queue_is_full():
+    release.clear()
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        running = pool.submit(client.get, "/blocking")
+        assert started.acquire(timeout=5)
+        queued = pool.submit(client.get, "/blocking")
+        wait_for(lambda: executor.stats()["queued"] == 1)
+        # Only the running call holds the resource, on its worker thread.
+        assert len(resources_held) == 1 and resources_held[0].startswith("bounded")
+
+        response = client.get("/blocking")
+        assert response.status_code == 503
+        assert len(resources_held) == 1
+        assert response.headers["Retry-After"] == "1"
+        assert executor.stats()["rejected"] == 1
+
+        release.set()
+        assert running.result().status_code == 200
+        assert queued.result().status_code == 200
+    assert running.result().json()["thread"].startswith("bounded")
+    assert executor.stats()["running"] == 0
+    assert resources_held == []
+
+
+def test_router_routes_run_on_executor_with_request_context():
+    response = client.get("/tagged", params={"value": 3})
+    assert response.status_code == 200
+    assert response.json() == {"tag": "/tagged", "value": 3}
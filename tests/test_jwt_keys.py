@@ -0,0 +1,73 @@
+import json
+import os
+import tempfile
+import time
+
+import pytest
+from jose import jwt
+
+from jwt_keys import KeyRing, add_key
+
+
+def sign(keyring: KeyRing, claims: dict) -> str:
+    kid, algorithm, key = keyring.signing_key()
+    return jwt.encode(claims, key, algorithm=algorithm, headers={"kid": kid} if kid else None)
+
+
+def verify(keyring: KeyRing, token: str) -> dict:
+    algorithm, key = keyring.verification_key(jwt.get_unverified_header(token).get("kid"))
+    return jwt.decode(token, key, algorithms=[algorithm])
+
+
+@pytest.mark.parametrize("algorithm", ["RS256", "ES256", "EdDSA"])
+def test_asymmetric_round_trip_with_public_jwks(algorithm):
+    path = os.path.join(tempfile.mkdtemp(), "jwks.json")
+    add_key(path, algorithm, kid="first")
+    keyring = KeyRing(jwks_path=path)
+    token = sign(keyring, {"sub": "johndoe"})
+    assert jwt.get_unverified_header(token) == {"alg": algorithm, "kid": "first", "typ": "JWT"}
+    assert verify(keyring, token) == {"sub": "johndoe"}
+
+    (public,) = keyring.public_jwks()["keys"]
+    assert "d" not in public
+    assert jwt.decode(token, public, algorithms=[algorithm]) == {"sub": "johndoe"}
+
+
+def test_jwks_file_is_hot_reloaded_on_rotation():
+    path = os.path.join(tempfile.mkdtemp(), "jwks.json")
+    add_key(path, "EdDSA", kid="old")
+    keyring = KeyRing(jwks_path=path, reload_interval=0)
+    old_token = sign(keyring, {"sub": "johndoe"})
+
+    time.sleep(0.01)
+    add_key(path, "RS256", kid="new")
+    assert jwt.get_unverified_header(sign(keyring, {"sub": "johndoe"}))["kid"] == "new"
+    assert verify(keyring, old_token) == {"sub": "johndoe"}
+    assert keyring.reloads == 2
+
+    time.sleep(0.01)
+    with open(path, "w") as jwks_file:
+        json.dump({"keys": [{"kid": "broken", "alg": "RS256", "kty": "RSA"}]}, jwks_file)
+    assert verify(keyring, old_token) == {"sub": "johndoe"}
+    assert keyring.verification_key("broken") is None
+
+
+def test_shared_secret_keyring_has_no_kid():
+    keyring = KeyRing("secret", "HS256")
+    token = sign(keyring, {"sub": "johndoe"})
+    assert "kid" not in jwt.get_unverified_header(token)
+    assert verify(keyring, token) == {"sub": "johndoe"}
+    assert keyring.public_jwks() == {"keys": []}
+
+
+def test_broken_jwks_files_keep_the_old_keys():
+    path = os.path.join(tempfile.mkdtemp(), "jwks.json")
+    add_key(path, "ES256", kid="old")
+    keyring = KeyRing(jwks_path=path, reload_interval=0)
+    token = sign(keyring, {"sub": "johndoe"})
+    for broken in ({"keys": {"kid": "x"}}, {"keys": [{"kid": "x", "alg": "HS256", "kty": "oct", "k": "c2VjcmV0"}]}):
+        time.sleep(0.01)
+        with open(path, "w") as jwks_file:
+            json.dump(broken, jwks_file)
+        assert verify(keyring, token) == {"sub": "johndoe"}
+    assert keyring.reloads == 1
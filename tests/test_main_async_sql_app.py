@@ -0,0 +1,28 @@
+import json
+import os
+import tempfile
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "notes.db"))
+
+from fastapi.testclient import TestClient
+
+import main_async_sql_app
+
+
+def test_batch_returns_ids_in_order_and_streams_ndjson():
+    notes = [{"text": f"note {i}", "completed": i % 2 == 0} for i in range(2500)]
+    with TestClient(main_async_sql_app.app) as client:
+        response = client.post("/notes/batch", json=notes)
+        assert response.status_code == 200
+        ids = response.json()
+        assert len(ids) == 2500
+
+        response = client.get("/notes/", headers={"Accept": main_async_sql_app.NDJSON_MEDIA_TYPE})
+        assert response.headers["content-type"] == main_async_sql_app.NDJSON_MEDIA_TYPE
+        lines = response.text.splitlines()
+        streamed = {note["id"]: note for note in map(json.loads, lines)}
+        assert len(lines) == len(streamed)
+        assert [streamed[note_id]["text"] for note_id in ids] == [note["text"] for note in notes]
+        assert [streamed[note_id]["completed"] for note_id in ids] == [note["completed"] for note in notes]
+
+        assert client.get("/notes/", params={"stream": True}).json() == list(map(json.loads, lines))
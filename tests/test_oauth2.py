@@ -0,0 +1,196 @@
+import os
+import time
+
+import pytest
+from fastapi import Depends, FastAPI, Security
+from fastapi.testclient import TestClient
+
+import main_oauth2
+import main_oauth2_2
+
+
+@pytest.fixture(scope="module", params=[main_oauth2, main_oauth2_2], ids=lambda module: module.__name__)
+def app_client(request):
+    with TestClient(request.param.app) as client:
+        yield request.param, client
+
+
+def login(client, password: str, **form):
+    return client.post("/token", data={"username": "johndoe", "password": password, **form})
+
+
+def test_login_verifies_password_off_the_event_loop(app_client):
+    _, client = app_client
+    response = login(client, "secret", scope="me items")
+    assert response.status_code == 200
+    token = response.json()["access_token"]
+
+    response = client.get("/users/me/items/", headers={"Authorization": f"Bearer {token}"})
+    assert response.json() == [{"item_id": "Foo", "owner": "johndoe"}]
+
+    assert login(client, "wrong").status_code in (400, 401)
+    stats = client.get("/token/stats").json()["password_hasher"]
+    assert stats["completed"] == 2
+    assert stats["running"] == stats["waiting"] == 0
+
+
+def test_password_hash_round_trip(app_client):
+    module, client = app_client
+
+    async def round_trip():
+        hashed = await module.get_password_hash("chimichangas4life")
+        return await module.verify_password("chimichangas4life", hashed)
+
+    assert client.portal.call(round_trip)
+
+
+def test_repeat_requests_reuse_the_verified_token(app_client, monkeypatch):
+    module, client = app_client
+    token = login(client, "secret", scope="me items").json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    assert client.get("/users/me/items/", headers=headers).status_code == 200
+
+    def decode(*args, **kwargs):
+        raise AssertionError("token verified twice")
+
+    monkeypatch.setattr(module.jwt, "decode", decode)
+    assert client.get("/users/me/items/", headers=headers).json() == [{"item_id": "Foo", "owner": "johndoe"}]
+    monkeypatch.undo()
+
+    assert client.post("/token/revoke", headers=headers).status_code == 204
+    assert client.get("/users/me/items/", headers=headers).status_code == 401
+
+
+def test_one_token_decode_per_request_across_security_dependencies(monkeypatch):
+    # Two Security() dependencies with different scopes, one of them nested:
+    # FastAPI runs get_current_user once per distinct scope set.
+    app = FastAPI()
+
+    @app.get("/both")
+    async def both(
+        active: main_oauth2_2.User = Security(main_oauth2_2.get_current_active_user, scopes=["items"]),
+        status: dict = Depends(main_oauth2_2.read_system_status),
+    ):
+        return {"owner": active.username, **status}
+
+    token = main_oauth2_2.create_access_token({"sub": "johndoe", "scopes": ["me", "items"]})
+    client = TestClient(app)
+    # Take the cross-request token cache out of the picture.
+    monkeypatch.setattr(main_oauth2_2.token_cache, "get", lambda token: None)
+    for _ in range(3):
+        decodes = main_oauth2_2.token_decodes
+        response = client.get("/both", headers={"Authorization": f"Bearer {token}"})
+        assert response.json() == {"owner": "johndoe", "status": "ok"}
+        assert main_oauth2_2.token_decodes == decodes + 1
+
+    # Each dependency still checks its own scopes against the shared result.
+    token = main_oauth2_2.create_access_token({"sub": "johndoe", "scopes": ["me"]})
+    response = client.get("/both", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 401
+    assert response.json() == {"detail": "Not enough permissions"}
+
+
+def test_tokens_signed_from_a_jwks_file(monkeypatch, tmp_path):
+    from jose import jwt
+
+    from jwt_keys import KeyRing, add_key
+
+    path = str(tmp_path / "jwks.json")
+    add_key(path, "EdDSA", kid="ed")
+    monkeypatch.setattr(main_oauth2_2, "keyring", KeyRing(jwks_path=path))
+    with TestClient(main_oauth2_2.app) as client:
+        token = login(client, "secret", scope="me").json()["access_token"]
+        assert jwt.get_unverified_header(token)["kid"] == "ed"
+        assert client.get("/users/me/", headers={"Authorization": f"Bearer {token}"}).status_code == 200
+
+        (public,) = client.get("/.well-known/jwks.json").json()["keys"]
+        assert public["kid"] == "ed" and "d" not in public
+        assert jwt.decode(token, public, algorithms=["EdDSA"])["sub"] == "johndoe"
+
+
+def test_login_attempts_are_rate_limited_before_hashing(app_client, monkeypatch):
+    from rate_limit import TokenBucket
+
+    module, client = app_client
+    monkeypatch.setattr(
+        module.login_rate_limit, "per_username", TokenBucket("username", capacity=2, per_second=0.001)
+    )
+    assert login(client, "wrong").status_code in (400, 401)
+    assert login(client, "wrong").status_code in (400, 401)
+    completed = client.get("/token/stats").json()["password_hasher"]["completed"]
+
+    response = login(client, "secret")
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 0
+    stats = client.get("/token/stats").json()
+    assert stats["password_hasher"]["completed"] == completed
+    assert stats["rate_limit"]["username"] == {"allowed": 2, "rejected": 1}
+    # Other usernames have buckets of their own.
+    assert client.post("/token", data={"username": "nobody", "password": "x"}).status_code in (400, 401)
+
+
+def test_opaque_session_tokens(monkeypatch):
+    from session_store import MemorySessionStore
+
+    monkeypatch.setattr(main_oauth2, "TOKEN_MODE", "opaque")
+    monkeypatch.setattr(main_oauth2, "sessions", MemorySessionStore(ttl=60))
+    with TestClient(main_oauth2.app) as client:
+        token = login(client, "secret").json()["access_token"]
+        assert token.count(".") == 0
+        headers = {"Authorization": f"Bearer {token}"}
+        assert client.get("/users/me", headers=headers).json()["username"] == "johndoe"
+        assert client.post("/token/revoke", headers=headers).status_code == 204
+        assert client.get("/users/me", headers=headers).status_code == 401
+        assert client.get("/token/stats").json()["sessions"] == {"sessions": 0, "hits": 2, "misses": 1}
+
+
+def test_removing_a_key_rejects_cached_tokens_it_signed(monkeypatch, tmp_path):
+    from jwt_keys import KeyRing, add_key
+
+    path = str(tmp_path / "jwks.json")
+    add_key(path, "ES256", kid="old")
+    keyring = KeyRing(jwks_path=path, reload_interval=0)
+    keyring.on_reload(main_oauth2_2.forget_removed_keys)
+    monkeypatch.setattr(main_oauth2_2, "keyring", keyring)
+    with TestClient(main_oauth2_2.app) as client:
+        token = login(client, "secret", scope="me").json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        assert client.get("/users/me/", headers=headers).status_code == 200
+
+        time.sleep(0.01)
+        os.remove(path)
+        add_key(path, "ES256", kid="new")
+        # The cached token is the only lookup here, so it has to notice the change itself.
+        assert client.get("/users/me/", headers=headers).status_code == 401
+        assert [key["kid"] for key in client.get("/.well-known/jwks.json").json()["keys"]] == ["new"]
+
+
+def test_malformed_kid_is_rejected_not_a_server_error():
+    from jose import jwt
+
+    with TestClient(main_oauth2_2.app) as client:
+        for kid in (["x"], {"a": 1}, 3):
+            token = jwt.encode({"sub": "johndoe"}, "whatever", algorithm="HS256", headers={"kid": kid})
+            response = client.get("/users/me/", headers={"Authorization": f"Bearer {token}"})
+            assert response.status_code == 401
+
+
+def test_sqlite_session_store_runs_off_the_event_loop(monkeypatch, tmp_path):
+    import threading
+
+    from session_store import SQLiteSessionStore
+
+    class RecordingStore(SQLiteSessionStore):
+        threads = set()
+
+        def get(self, session_id):
+            self.threads.add(threading.current_thread())
+            return super().get(session_id)
+
+    monkeypatch.setattr(main_oauth2, "TOKEN_MODE", "opaque")
+    monkeypatch.setattr(main_oauth2, "sessions", RecordingStore(str(tmp_path / "sessions.db"), ttl=60))
+    with TestClient(main_oauth2.app) as client:
+        loop_thread = client.portal.call(threading.current_thread)
+        token = login(client, "secret").json()["access_token"]
+        assert client.get("/users/me", headers={"Authorization": f"Bearer {token}"}).status_code == 200
+    assert RecordingStore.threads and loop_thread not in RecordingStore.threads
@@ -0,0 +1,46 @@
+import time
+
+from rate_limit import MemoryBuckets, SQLiteBuckets, TokenBucket, refill
+
+
+def test_refill_caps_at_capacity_and_reports_the_wait():
+    assert refill(0, 0, 100, capacity=5, per_second=1) == (4, 0)
+    assert refill(0.5, 10, 10, capacity=5, per_second=0.25) == (0.5, 2)
+
+
+def test_burst_then_refill():
+    bucket = TokenBucket("username", capacity=2, per_second=20)
+    assert [bucket.take("johndoe") for _ in range(2)] == [0, 0]
+    assert bucket.take("johndoe") > 0
+    assert bucket.take("alice") == 0
+    time.sleep(0.06)
+    assert bucket.take("johndoe") == 0
+    assert bucket.stats() == {"allowed": 4, "rejected": 1}
+
+
+def test_memory_buckets_evict_least_recently_used():
+    backend = MemoryBuckets(max_keys=2)
+    bucket = TokenBucket("ip", capacity=1, per_second=0.001, backend=backend)
+    bucket.take("a")
+    bucket.take("b")
+    bucket.take("c")
+    assert len(backend) == 2
+    # "a" was dropped, so it starts over with a full bucket.
+    assert bucket.take("a") == 0
+    assert bucket.take("c") > 0
+
+
+def test_sqlite_buckets_are_shared_between_workers(tmp_path):
+    path = str(tmp_path / "buckets.db")
+    first = TokenBucket("username", capacity=3, per_second=0.001, backend=SQLiteBuckets(path))
+    second = TokenBucket("username", capacity=3, per_second=0.001, backend=SQLiteBuckets(path))
+    assert [first.take("johndoe"), second.take("johndoe"), first.take("johndoe")] == [0, 0, 0]
+    assert second.take("johndoe") > 0
+
+
+def test_sqlite_buckets_evict_least_recently_used(tmp_path):
+    backend = SQLiteBuckets(str(tmp_path / "buckets.db"), max_keys=5, evict_every=10)
+    bucket = TokenBucket("ip", capacity=1, per_second=1, backend=backend)
+    for i in range(20):
+        bucket.take(str(i))
+    assert len(backend) == 5
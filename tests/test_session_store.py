@@ -0,0 +1,57 @@
+import time
+
+import pytest
+
+from session_store import MemorySessionStore, SQLiteSessionStore
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path):
+    def make(ttl):
+        if request.param == "memory":
+            return MemorySessionStore(ttl)
+        # Renew on every lookup, like the memory store.
+        return SQLiteSessionStore(str(tmp_path / "sessions.db"), ttl, touch_interval=0)
+
+    return make
+
+
+def test_sessions_resolve_until_revoked(make_store):
+    store = make_store(ttl=60)
+    session_id = store.create("johndoe")
+    assert store.get(session_id) == "johndoe"
+    assert store.get("not-a-session") is None
+    store.revoke(session_id)
+    assert store.get(session_id) is None
+    assert store.stats() == {"sessions": 0, "hits": 1, "misses": 2}
+
+
+def test_expiry_slides_with_use(make_store):
+    store = make_store(ttl=0.2)
+    used, idle = store.create("johndoe"), store.create("alice")
+    for _ in range(3):
+        time.sleep(0.1)
+        assert store.get(used) == "johndoe"
+    assert store.get(idle) is None
+
+
+def test_memory_store_evicts_expired_and_oldest_sessions():
+    store = MemorySessionStore(ttl=0.05, max_entries=2)
+    store.create("a")
+    time.sleep(0.06)
+    second = store.create("b")
+    assert store.stats()["sessions"] == 1
+    store.create("c")
+    store.get(second)
+    store.create("d")
+    assert store.stats()["sessions"] == 2
+    assert store.get(second) == "b"
+
+
+def test_sqlite_sessions_are_shared_between_workers(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    first, second = SQLiteSessionStore(path, ttl=60), SQLiteSessionStore(path, ttl=60)
+    session_id = first.create("johndoe")
+    assert second.get(session_id) == "johndoe"
+    second.revoke(session_id)
+    assert first.get(session_id) is None
@@ -0,0 +1,232 @@
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+
+os.environ.setdefault(
+    "SQLALCHEMY_DATABASE_URL",
+    "sqlite:///" + os.path.join(tempfile.mkdtemp(), "sql_app.db"),
+)
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from sql_app import crud, database, models
+from sql_app.database import ReplicaSet, SessionLocal, engine, make_engine
+from sql_app.main import app
+
+client = TestClient(app)
+
+
+@contextmanager
+def count_queries():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def create_users_with_items(prefix: str, count: int):
+    for i in range(count):
+        user_id = client.post("/users/", json={"email": f"{prefix}{i}@example.com", "password": "secret"}).json()["id"]
+        for title in ("Foo", "Bar"):
+            client.post(f"/users/{user_id}/items/", json={"title": title})
+
+
+def test_create_and_read_user():
+    response = client.post("/users/", json={"email": "deadpool@example.com", "password": "chimichangas4life"})
+    assert response.status_code == 200
+    user_id = response.json()["id"]
+
+    response = client.get(f"/users/{user_id}")
+    assert response.status_code == 200
+    assert response.json() == {"email": "deadpool@example.com", "id": user_id, "is_active": True, "items": []}
+
+
+def test_one_session_per_request_checkout_counts():
+    response = client.post("/users/", json={"email": "checkout@example.com", "password": "secret"})
+    # commit() hands the connection back, refresh() checks it out again.
+    assert response.headers["X-DB-Checkouts"] == "2"
+
+    response = client.get(f"/users/{response.json()['id']}")
+    assert response.headers["X-DB-Checkouts"] == "1"
+
+
+def test_no_pool_checkout_without_db():
+    assert client.get("/docs").headers["X-DB-Checkouts"] == "0"
+    assert client.get("/nowhere").headers["X-DB-Checkouts"] == "0"
+
+
+def test_cursor_pagination():
+    for i in range(5):
+        client.post("/users/", json={"email": f"page{i}@example.com", "password": "secret"})
+    expected = [user["id"] for user in client.get("/users/", params={"limit": 1000}).json()]
+
+    seen = []
+    response = client.get("/users/", params={"limit": 2})
+    while True:
+        seen += [user["id"] for user in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+        response = client.get("/users/", params={"limit": 2, "cursor": cursor})
+    assert seen == expected
+
+
+def test_invalid_cursor():
+    response = client.get("/items/", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Invalid cursor"}
+
+
+def test_read_users_has_no_n_plus_one():
+    create_users_with_items("nplusone", 10)
+    with count_queries() as queries:
+        response = client.get("/users/", params={"limit": 1000})
+    assert len(response.json()) >= 10
+    assert all(len(user["items"]) == 2 for user in response.json() if user["email"].startswith("nplusone"))
+    assert len(queries) == 2
+
+
+def test_read_user_query_count():
+    user_id = client.post("/users/", json={"email": "single@example.com", "password": "secret"}).json()["id"]
+    client.post(f"/users/{user_id}/items/", json={"title": "Foo"})
+    with count_queries() as queries:
+        response = client.get(f"/users/{user_id}")
+    assert len(response.json()["items"]) == 1
+    assert len(queries) == 2
+
+
+@pytest.mark.parametrize("items, extra_queries", [(None, "per_user"), ("selectin", 1), ("joined", 0)])
+def test_get_users_items_loading(items, extra_queries):
+    create_users_with_items(f"loading-{items}-", 3)
+    db = SessionLocal()
+    try:
+        with count_queries() as queries:
+            users = crud.get_users(db, limit=1000, items=items)
+            for user in users:
+                list(user.items)
+    finally:
+        db.close()
+    expected = 1 + (len(users) if extra_queries == "per_user" else extra_queries)
+    assert len(queries) == expected
+
+
+def test_bulk_create_users_and_items():
+    users = [{"email": f"bulk{i}@example.com", "password": "secret"} for i in range(2500)]
+    with count_queries() as queries:
+        response = client.post("/users/bulk", json=users)
+    assert response.status_code == 200
+    user_ids = response.json()
+    assert len(user_ids) == 2500
+    # Email lookups and INSERTs both go in batches of 1000 rows.
+    assert len(queries) == 6
+    for i in (0, 999, 1000, 2499):
+        assert client.get(f"/users/{user_ids[i]}").json()["email"] == f"bulk{i}@example.com"
+
+    response = client.post(f"/users/{user_ids[0]}/items/bulk", json=[{"title": f"Item {i}"} for i in range(3)])
+    assert response.status_code == 200
+    assert [item["id"] for item in client.get(f"/users/{user_ids[0]}").json()["items"]] == response.json()
+
+    response = client.post("/users/bulk", json=[{"email": "bulk0@example.com", "password": "secret"}])
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Email already registered"}
+
+
+def test_streaming_modes_match_buffered_response():
+    create_users_with_items("stream", 3)
+    params = {"limit": 1000}
+    buffered = client.get("/users/", params=params).json()
+
+    response = client.get("/users/", params={**params, "stream": True})
+    assert response.headers["content-type"] == "application/json"
+    assert response.json() == buffered
+
+    response = client.get("/users/", params=params, headers={"Accept": "application/x-ndjson"})
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line) for line in response.text.splitlines()] == buffered
+
+    items = client.get("/items/", params=params).json()
+    assert client.get("/items/", params={**params, "stream": True}).json() == items
+
+
+def test_read_user_is_cached_until_items_change():
+    user_id = client.post("/users/", json={"email": "cached@example.com", "password": "secret"}).json()["id"]
+    client.get(f"/users/{user_id}")
+    hits = client.get("/cache/stats").json()["hits"]
+    with count_queries() as queries:
+        response = client.get(f"/users/{user_id}")
+    assert response.json()["items"] == []
+    assert len(queries) == 0
+    assert client.get("/cache/stats").json()["hits"] == hits + 1
+
+    client.post(f"/users/{user_id}/items/", json={"title": "Foo"})
+    assert [item["title"] for item in client.get(f"/users/{user_id}").json()["items"]] == ["Foo"]
+
+    response = client.post("/users/", json={"email": "cached@example.com", "password": "secret"})
+    assert response.status_code == 400
+
+
+def make_replica_engines(count: int):
+    # Stand-ins for replicas: separate SQLite files, each holding one user
+    # that names it.
+    engines = []
+    for i in range(count):
+        replica = make_engine("sqlite:///" + os.path.join(tempfile.mkdtemp(), f"replica{i}.db"))
+        models.Base.metadata.create_all(bind=replica)
+        with replica.begin() as conn:
+            conn.execute(models.User.__table__.insert(), {"email": f"replica{i}@example.com", "hashed_password": "x"})
+        engines.append(replica)
+    return engines
+
+
+def test_reads_go_to_replicas_until_the_client_writes(monkeypatch):
+    monkeypatch.setattr(database, "replicas", ReplicaSet(make_replica_engines(2)))
+    reader = TestClient(app)
+    emails = [reader.get("/users/").json()[0]["email"] for _ in range(4)]
+    assert emails == ["replica0@example.com", "replica1@example.com"] * 2
+
+    response = reader.post("/users/", json={"email": "primary@example.com", "password": "secret"})
+    assert "db-primary-until" in response.headers["set-cookie"]
+    # The replicas have never heard of this user; only the primary has it.
+    assert reader.get(f"/users/{response.json()['id']}").json()["email"] == "primary@example.com"
+
+
+def test_least_connections_picks_the_idle_replica():
+    busy, idle = make_replica_engines(2)
+    replicas = ReplicaSet([busy, idle], "least-connections")
+    with busy.connect():
+        assert replicas.choose() is idle
+    assert replicas.in_use == {id(busy): 0, id(idle): 0}
+
+
+def test_replica_reads_do_not_fill_the_cache_for_writers(monkeypatch):
+    writer = TestClient(app)
+    user_id = writer.post("/users/", json={"email": "lagging@example.com", "password": "secret"}).json()["id"]
+
+    # A replica that has the user but not the item added below.
+    lagging = make_engine("sqlite:///" + os.path.join(tempfile.mkdtemp(), "lagging.db"))
+    models.Base.metadata.create_all(bind=lagging)
+    with lagging.begin() as conn:
+        conn.execute(
+            models.User.__table__.insert(),
+            {"id": user_id, "email": "lagging@example.com", "hashed_password": "x", "is_active": True},
+        )
+    monkeypatch.setattr(database, "replicas", ReplicaSet([lagging]))
+
+    writer.post(f"/users/{user_id}/items/", json={"title": "Fresh"})
+    assert TestClient(app).get(f"/users/{user_id}").json()["items"] == []
+    assert [item["title"] for item in writer.get(f"/users/{user_id}").json()["items"]] == ["Fresh"]
+
+    # Once the cookie has expired the writer reads the replica too, but the
+    # cache was never filled from it.
+    writer.cookies.clear()
+    monkeypatch.setattr(database, "replicas", None)
+    assert [item["title"] for item in writer.get(f"/users/{user_id}").json()["items"]] == ["Fresh"]
@@ -0,0 +1,70 @@
+import os
+import tempfile
+
+os.environ.setdefault(
+    "SQLALCHEMY_ASYNC_DATABASE_URL",
+    "sqlite+aiosqlite:///" + os.path.join(tempfile.mkdtemp(), "sql_app_async.db"),
+)
+
+import pytest
+from fastapi.testclient import TestClient
+
+from sql_app.async_main import app
+
+
+@pytest.fixture(scope="module")
+def client():
+    # One event loop for the whole module: pooled aiosqlite connections
+    # belong to the loop that opened them.
+    with TestClient(app) as client:
+        yield client
+
+
+def test_create_and_read_user(client):
+    response = client.post("/users/", json={"email": "async@example.com", "password": "secret"})
+    assert response.status_code == 200
+    user = response.json()
+    item = client.post(f"/users/{user['id']}/items/", json={"title": "First"}).json()
+    assert client.get(f"/users/{user['id']}").json() == {**user, "items": [item]}
+    assert client.get("/users/0").status_code == 404
+
+    response = client.post("/users/", json={"email": "async@example.com", "password": "secret"})
+    assert response.status_code == 400
+
+
+def test_bulk_create_returns_ids_in_order(client):
+    users = [{"email": f"async-bulk{i}@example.com", "password": "secret"} for i in range(2500)]
+    response = client.post("/users/bulk", json=users)
+    assert response.status_code == 200
+    user_ids = response.json()
+    assert len(user_ids) == 2500
+    for i in (0, 999, 1000, 2499):
+        assert client.get(f"/users/{user_ids[i]}").json()["email"] == f"async-bulk{i}@example.com"
+
+    response = client.post(f"/users/{user_ids[0]}/items/bulk", json=[{"title": f"Item {i}"} for i in range(3)])
+    assert response.status_code == 200
+    assert [item["id"] for item in client.get(f"/users/{user_ids[0]}").json()["items"]] == response.json()
+
+    response = client.post("/users/bulk", json=[{"email": "async-bulk0@example.com", "password": "secret"}])
+    assert response.status_code == 400
+
+
+def test_cursor_pagination(client):
+    for i in range(5):
+        client.post("/users/", json={"email": f"async-page{i}@example.com", "password": "secret"})
+    expected = [user["id"] for user in client.get("/users/", params={"limit": 10000}).json()]
+    limit = len(expected) // 3 + 1
+
+    seen = []
+    pages = 0
+    response = client.get("/users/", params={"limit": limit})
+    while True:
+        seen += [user["id"] for user in response.json()]
+        pages += 1
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+        response = client.get("/users/", params={"limit": limit, "cursor": cursor})
+    assert seen == expected
+    assert pages == 3
+    assert client.get("/items/", params={"cursor": "not-a-cursor"}).status_code == 400
@@ -0,0 +1,109 @@
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("PEEWEE_DATABASE_NAME", os.path.join(tempfile.mkdtemp(), "sql_app_peewee.db"))
+
+from fastapi.testclient import TestClient
+
+from sql_app_peewee import database, main
+from sql_app_peewee.executors import BoundedExecutor
+
+client = TestClient(main.app)
+
+
+def wait_for(condition, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def test_queued_slow_requests_hold_no_pool_slot(monkeypatch):
+    release = threading.Event()
+    started = threading.Semaphore(0)
+
+    def get_users(skip: int = 0, limit: int = 100):
+        started.release()
+        release.wait(5)
+        return []
+
+    monkeypatch.setattr(main, "sleep_time", 0)
+    monkeypatch.setattr(main.crud, "get_users", get_users)
+    monkeypatch.setattr(database, "DATABASE_POOL_SIZE", 2)
+    monkeypatch.setattr(main, "pool_slots", threading.BoundedSemaphore(2))
+    executor = BoundedExecutor(max_workers=1, queue_size=1)
+    for name in ("max_workers", "queue_size", "executor"):
+        monkeypatch.setattr(main.slow_executor, name, getattr(executor, name))
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        running = pool.submit(client.get, "/slowusers/")
+        assert started.acquire(timeout=5)
+        queued = pool.submit(client.get, "/slowusers/")
+        wait_for(lambda: main.slow_executor.stats()["queued"] == 1)
+        assert client.get("/slowusers/").status_code == 503
+
+        # The running call has one of the two slots; the queued and the
+        # rejected ones have none.
+        assert main.pool_slots.acquire(blocking=False)
+        main.pool_slots.release()
+
+        release.set()
+        assert running.result().json() == []
+        assert queued.result().json() == []
+    executor.shutdown()
+
+
+def test_bulk_create_returns_ids_in_order():
+    users = [{"email": f"peewee-bulk{i}@example.com", "password": "secret"} for i in range(2500)]
+    response = client.post("/users/bulk", json=users)
+    assert response.status_code == 200
+    user_ids = response.json()
+    assert len(user_ids) == 2500
+    for i in (0, 999, 1000, 2499):
+        assert client.get(f"/users/{user_ids[i]}").json()["email"] == f"peewee-bulk{i}@example.com"
+
+    response = client.post(f"/users/{user_ids[0]}/items/bulk", json=[{"title": f"Item {i}", "description": "bulk"} for i in range(3)])
+    assert response.status_code == 200
+    assert [item["id"] for item in client.get(f"/users/{user_ids[0]}").json()["items"]] == response.json()
+
+    response = client.post("/users/bulk", json=[{"email": "peewee-bulk0@example.com", "password": "secret"}])
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Email already registered"}
+
+
+def test_cached_user_is_invalidated_by_new_items():
+    user = client.post("/users/", json={"email": "peewee-cache@example.com", "password": "secret"}).json()
+    before = client.get("/cache/stats").json()
+    assert client.get(f"/users/{user['id']}").json()["items"] == []
+    assert client.get(f"/users/{user['id']}").json()["items"] == []
+    after = client.get("/cache/stats").json()
+    assert after["hits"] - before["hits"] >= 1
+
+    item = client.post(f"/users/{user['id']}/items/", json={"title": "Fresh", "description": "new"}).json()
+    assert client.get(f"/users/{user['id']}").json()["items"] == [item]
+    response = client.post("/users/", json={"email": "peewee-cache@example.com", "password": "secret"})
+    assert response.status_code == 400
+
+
+def test_cursor_pagination():
+    for i in range(5):
+        client.post("/users/", json={"email": f"peewee-page{i}@example.com", "password": "secret"})
+    expected = [user["id"] for user in client.get("/users/", params={"limit": 10000}).json()]
+    limit = len(expected) // 3 + 1
+
+    seen = []
+    pages = 0
+    response = client.get("/users/", params={"limit": limit})
+    while True:
+        seen += [user["id"] for user in response.json()]
+        pages += 1
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+        response = client.get("/users/", params={"limit": limit, "cursor": cursor})
+    assert seen == expected
+    assert pages == 3
+    assert client.get("/items/", params={"cursor": "not-a-cursor"}).status_code == 400
@@ -0,0 +1,37 @@
+import time
+
+from token_cache import VerifiedTokenCache
+
+
+def test_entries_expire_with_the_token():
+    cache = VerifiedTokenCache()
+    cache.put("live", time.time() + 60, "johndoe", "user")
+    cache.put("expired", time.time() - 1, "johndoe", "user")
+    assert cache.get("live") == "user"
+    assert cache.get("expired") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_bounded_and_least_recently_used_first():
+    cache = VerifiedTokenCache(max_entries=2)
+    exp = time.time() + 60
+    cache.put("a", exp, "alice", 1)
+    cache.put("b", exp, "bob", 2)
+    cache.get("a")
+    cache.put("c", exp, "carol", 3)
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+
+
+def test_revocation_hooks():
+    cache = VerifiedTokenCache()
+    exp = time.time() + 60
+    cache.put("first", exp, "johndoe", "user")
+    cache.put("second", exp, "johndoe", "user")
+    cache.revoke("first", exp)
+    assert cache.get("first") is None and cache.is_revoked("first")
+
+    cache.forget_subject("johndoe")
+    assert cache.get("second") is None and not cache.is_revoked("second")
+
+    cache.revoke("stale", time.time() - 1)
+    assert not cache.is_revoked("stale")
@@ -0,0 +1,45 @@
+import asyncio
+
+import pytest
+from pydantic import BaseModel
+
+from user_repository import DictUserBackend, UserBackend, UserRepository
+
+
+class FrozenUser(BaseModel):
+    username: str
+    disabled: bool = False
+
+    class Config:
+        frozen = True
+
+
+def test_lookups_share_one_validated_instance_and_refresh_incrementally():
+    backend = DictUserBackend({"johndoe": {"username": "johndoe"}, "alice": {"username": "alice"}})
+    repository = UserRepository(backend, FrozenUser)
+    changed = []
+    repository.on_change(changed.append)
+
+    async def scenario():
+        user = await repository.get("johndoe")
+        assert user is await repository.get("johndoe")
+        with pytest.raises((TypeError, ValueError)):
+            user.disabled = True
+
+        backend.put({"username": "johndoe", "disabled": True})
+        backend.remove("alice")
+        assert await repository.refresh() == ["johndoe", "alice"]
+        assert (await repository.get("johndoe")).disabled
+        assert await repository.get("alice") is None
+        assert await repository.refresh() == []
+
+    asyncio.run(scenario())
+    assert changed == ["johndoe", "alice"]
+
+
+def test_backend_without_changes_since_cannot_be_created():
+    class Incomplete(UserBackend):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
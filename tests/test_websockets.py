@@ -0,0 +1,204 @@
+import asyncio
+import zlib
+
+import msgpack
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketState
+
+import main_websockets
+from main_websockets import ConnectionManager, DeflateMsgpackCodec, MsgpackCodec, OverflowPolicy, UnixSocketBackplane
+
+
+class FakeWebSocket:
+    # Records the frames the manager sends. A websocket with block set never
+    # finishes a send, like a client that stopped reading.
+    def __init__(self, block: bool = False):
+        self.block = block
+        self.sent = []
+        self.closed_with = None
+        self.client_state = WebSocketState.CONNECTING
+        self.application_state = WebSocketState.CONNECTING
+
+    async def accept(self, subprotocol: str = None):
+        self.client_state = WebSocketState.CONNECTED
+        self.application_state = WebSocketState.CONNECTED
+
+    async def send(self, message: dict):
+        if self.block:
+            await asyncio.Event().wait()
+        self.sent.append(message.get("text", message.get("bytes")))
+
+    async def close(self, code: int = 1000, reason: str = None):
+        self.closed_with = code
+        self.application_state = WebSocketState.DISCONNECTED
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_subscribers_of_several_topics_get_a_message_once():
+    async def scenario():
+        manager = ConnectionManager()
+        both, lobby_only = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(both, 1)
+        await manager.connect(lobby_only, 2)
+        for topic in ("lobby", "x"):
+            manager.join(1, topic)
+        manager.join(2, "lobby")
+        await manager.publish_many(["lobby", "x"], {"event": "say", "client_id": 2, "text": "yo"})
+        await settle()
+        return both.sent, lobby_only.sent
+
+    assert asyncio.run(scenario()) == (["Client #2 says: yo"], ["Client #2 says: yo"])
+
+
+def test_late_disconnect_of_a_replaced_connection_is_ignored():
+    async def scenario():
+        manager = ConnectionManager()
+        old, new = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(old, 3)
+        await manager.connect(new, 3)
+        assert not manager.disconnect(3, old)
+        assert manager.active_connections[3].websocket is new
+        assert manager.disconnect(3, new)
+        assert manager.active_connections == {}
+
+    asyncio.run(scenario())
+
+
+async def fill_stuck_outbox(policy: OverflowPolicy):
+    # The writer takes m0 and never finishes sending it; m1 and m2 fill the
+    # queue and m3 overflows it.
+    manager = ConnectionManager(queue_size=2, overflow_policy=policy)
+    websocket = FakeWebSocket(block=True)
+    await manager.connect(websocket, 1)
+    for i in range(4):
+        await manager.send_personal_message({"event": "echo", "text": f"m{i}"}, 1)
+        await settle()
+    outbox = manager.active_connections.get(1)
+    frames = None if outbox is None else [frame["text"] for frame in outbox.frames]
+    stats = manager.stats()
+    for task in [o.writer for o in manager.active_connections.values()]:
+        task.cancel()
+    return websocket, frames, stats
+
+
+@pytest.mark.parametrize(
+    "policy, frames, dropped, coalesced",
+    [
+        (OverflowPolicy.drop_oldest, ["You wrote: m2", "You wrote: m3"], 1, 0),
+        (OverflowPolicy.drop_newest, ["You wrote: m1", "You wrote: m2"], 1, 0),
+        (OverflowPolicy.coalesce, ["You wrote: m1", "You wrote: m2\nYou wrote: m3"], 0, 1),
+    ],
+)
+def test_overflow_policies(policy, frames, dropped, coalesced):
+    websocket, queued, (stats,) = asyncio.run(fill_stuck_outbox(policy))
+    assert queued == frames
+    assert (stats["depth"], stats["dropped"], stats["coalesced"]) == (2, dropped, coalesced)
+    assert websocket.closed_with is None
+
+
+def test_overflow_disconnect_policy_evicts_the_client():
+    websocket, queued, stats = asyncio.run(fill_stuck_outbox(OverflowPolicy.disconnect))
+    assert queued is None and stats == []
+    assert websocket.closed_with == 1008
+
+
+def test_stuck_writers_are_evicted_after_send_timeout():
+    async def scenario():
+        manager = ConnectionManager(send_timeout=0.05)
+        stuck, healthy = FakeWebSocket(block=True), FakeWebSocket()
+        await manager.connect(stuck, 1)
+        await manager.connect(healthy, 2)
+        await manager.broadcast({"event": "say", "client_id": 2, "text": "hi"})
+        await asyncio.sleep(0.15)
+        await settle()
+        remaining = list(manager.active_connections)
+        await manager.broadcast({"event": "say", "client_id": 2, "text": "still here"})
+        await settle()
+        for outbox in manager.active_connections.values():
+            outbox.writer.cancel()
+        return remaining, stuck.closed_with, healthy.sent
+
+    remaining, closed_with, delivered = asyncio.run(scenario())
+    assert remaining == [2] and closed_with == 1008
+    assert delivered == ["Client #2 says: hi", "Client #2 says: still here"]
+
+
+def test_codecs_round_trip_and_compress_only_large_messages():
+    codec = DeflateMsgpackCodec(min_size=256)
+    small = {"event": "say", "client_id": 1, "text": "hi"}
+    large = {"event": "say", "client_id": 1, "text": "hello " * 200}
+    assert codec.pack(small)[:1] == b"\x00" and codec.unpack(codec.pack(small)) == small
+    assert codec.pack(large)[:1] == b"\x01" and codec.unpack(codec.pack(large)) == large
+    assert MsgpackCodec().unpack(MsgpackCodec().pack(large)) == large
+
+
+def test_deflate_codec_refuses_to_inflate_past_max_size():
+    codec = DeflateMsgpackCodec(max_size=65536)
+    bomb = b"\x01" + zlib.compress(msgpack.packb({"text": "a" * (1 << 20)}))
+    assert len(bomb) < 2048
+    with pytest.raises(ValueError):
+        codec.unpack(bomb)
+    with pytest.raises(ValueError):
+        codec.unpack(b"\x02" + msgpack.packb({"text": "x"}))
+
+
+@pytest.mark.parametrize(
+    "subprotocol, frame",
+    [
+        ("chat.msgpack", b"\xc1"),
+        ("chat.msgpack", msgpack.packb({"text": 5})),
+        ("chat.msgpack.deflate", b"\x01not deflate"),
+        ("chat.msgpack.deflate", b"\x01" + zlib.compress(msgpack.packb({"text": "a" * (1 << 20)}))),
+    ],
+)
+def test_malformed_binary_frames_close_with_1003(subprotocol, frame):
+    client = TestClient(main_websockets.app)
+    with client.websocket_connect("/ws/7", subprotocols=[subprotocol]) as websocket:
+        codec = main_websockets.CODECS[subprotocol]
+        websocket.send_bytes(codec.pack({"text": "hello"}))
+        assert codec.unpack(websocket.receive_bytes()) == {"event": "echo", "text": "hello"}
+        assert codec.unpack(websocket.receive_bytes()) == {"event": "say", "client_id": 7, "text": "hello"}
+        websocket.send_bytes(frame)
+        message = websocket.receive()
+    assert message == {"type": "websocket.close", "code": 1003, "reason": ""}
+
+
+async def wait_for(predicate, timeout: float = 5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def test_unix_socket_backplane_batches_topic_messages_between_managers(tmp_path):
+    async def scenario():
+        backplanes = [UnixSocketBackplane(str(tmp_path), batch_interval=0.05) for _ in range(2)]
+        # Both live in this process, so give the second its own socket.
+        backplanes[1].path = str(tmp_path / "peer.sock")
+        sender, receiver = [ConnectionManager(backplane=backplane) for backplane in backplanes]
+        await sender.start()
+        await receiver.start()
+        await wait_for(lambda: all(backplane.peers for backplane in backplanes))
+        subscribed, elsewhere = FakeWebSocket(), FakeWebSocket()
+        await receiver.connect(subscribed, 1)
+        await receiver.connect(elsewhere, 2)
+        receiver.join(1, "lobby")
+        receiver.join(2, "other")
+        for i in range(5):
+            await sender.publish("lobby", {"event": "say", "client_id": 9, "text": f"m{i}"})
+        await wait_for(lambda: len(subscribed.sent) == 5)
+        assert subscribed.sent == [f"Client #9 says: m{i}" for i in range(5)]
+        assert elsewhere.sent == []
+        assert (backplanes[0].batches_sent, backplanes[0].messages_sent) == (1, 5)
+        assert all(backplane._inbound for backplane in backplanes)
+        await sender.stop()
+        await receiver.stop()
+        assert not any(backplane._inbound or backplane.peers for backplane in backplanes)
+        assert list(tmp_path.iterdir()) == []
+
+    asyncio.run(scenario())
@@ -0,0 +1,88 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set
+
+
+class VerifiedTokenCache:
+    # Bearer tokens whose signature has already been checked, mapped to what
+    # they resolved to (the user, plus scopes where the app uses them). An
+    # entry lives until the token's own exp at the latest, and the least
+    # recently used ones go first once max_entries is reached.
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._by_subject: Dict[str, Set[str]] = {}
+        # Revoked tokens are remembered until they would have expired anyway.
+        self._revoked: Dict[str, float] = {}
+
+    def get(self, token: str) -> Optional[Any]:
+        entry = self._entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+        exp, subject, value = entry
+        if exp <= time.time():
+            self._discard(token)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return value
+
+    def put(self, token: str, exp: float, subject: str, value: Any):
+        if token in self._entries:
+            self._discard(token)
+        self._entries[token] = (exp, subject, value)
+        self._by_subject.setdefault(subject, set()).add(token)
+        while len(self._entries) > self.max_entries:
+            self._discard(next(iter(self._entries)))
+
+    def is_revoked(self, token: str) -> bool:
+        exp = self._revoked.get(token)
+        if exp is None:
+            return False
+        if exp <= time.time():
+            del self._revoked[token]
+            return False
+        return True
+
+    def revoke(self, token: str, exp: float):
+        # Revocation hook for logout or a leaked token: drop it from the cache
+        # and refuse it from now on, even though its signature still checks.
+        self._discard(token)
+        self._revoked[token] = exp
+        if len(self._revoked) > self.max_entries:
+            now = time.time()
+            self._revoked = {token: exp for token, exp in self._revoked.items() if exp > now}
+
+    def forget_subject(self, subject: str):
+        # Revocation hook for changes to the user itself (disabled, new
+        # scopes): its tokens are verified and resolved again on next use.
+        for token in list(self._by_subject.get(subject, ())):
+            self._discard(token)
+
+    def clear(self):
+        # Revocation hook for key rotation: every token is verified again on
+        # next use. Revoked tokens stay revoked.
+        self._entries.clear()
+        self._by_subject.clear()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "revoked": len(self._revoked),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def _discard(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self._by_subject.get(entry[1])
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._by_subject[entry[1]]
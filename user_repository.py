@@ -0,0 +1,107 @@
+import asyncio
+from abc import ABC, abstractmethod
+from types import MappingProxyType
+from typing import Callable, Dict, List, Mapping, Optional, Tuple, Type
+
+from pydantic import BaseModel
+
+
+class UserBackend(ABC):
+    # Where UserRepository reads users from. changes_since(None) returns every
+    # user; changes_since(version) only those added, changed or (as None)
+    # removed after version, together with the version they bring the caller
+    # up to. A SQL store would answer it from an updated_at or change-log
+    # column instead of a full table scan.
+    @abstractmethod
+    async def changes_since(self, version: Optional[int]) -> Tuple[int, Dict[str, Optional[dict]]]:
+        ...
+
+
+class DictUserBackend(UserBackend):
+    # The in-memory fake_users_db of the examples, with a change log.
+    def __init__(self, users: Dict[str, dict]):
+        self.users = users
+        self.version = 0
+        self._changed: Dict[str, int] = {}
+
+    def put(self, user: dict):
+        self.version += 1
+        self.users[user["username"]] = user
+        self._changed[user["username"]] = self.version
+
+    def remove(self, username: str):
+        self.version += 1
+        self.users.pop(username, None)
+        self._changed[username] = self.version
+
+    async def changes_since(self, version: Optional[int]) -> Tuple[int, Dict[str, Optional[dict]]]:
+        if version is None:
+            return self.version, dict(self.users)
+        return self.version, {
+            username: self.users.get(username)
+            for username, changed in self._changed.items()
+            if changed > version
+        }
+
+
+class UserRepository:
+    # Users validated into model instances once, when they are loaded or
+    # change, and served from a read-only mapping that is swapped whole on
+    # refresh. Looking a user up is a dict lookup; the model should be frozen
+    # so one request cannot change the instance another one gets.
+    def __init__(self, backend: UserBackend, model: Type[BaseModel], refresh_interval: float = 5.0):
+        self.backend = backend
+        self.model = model
+        self.refresh_interval = refresh_interval
+        self.version: Optional[int] = None
+        self._users: Mapping[str, BaseModel] = MappingProxyType({})
+        self._listeners: List[Callable[[str], None]] = []
+        self._refresher: Optional[asyncio.Task] = None
+
+    async def get(self, username: str) -> Optional[BaseModel]:
+        if self.version is None:
+            await self.refresh()
+        return self._users.get(username)
+
+    def on_change(self, listener: Callable[[str], None]):
+        # Called with the username of every user that changed or went away,
+        # e.g. to drop cached tokens that resolved to the old instance.
+        self._listeners.append(listener)
+
+    async def refresh(self) -> List[str]:
+        version, changes = await self.backend.changes_since(self.version)
+        if not changes and self.version is not None:
+            self.version = version
+            return []
+        users = dict(self._users) if self.version is not None else {}
+        for username, record in changes.items():
+            if record is None:
+                users.pop(username, None)
+            else:
+                users[username] = self.model(**record)
+        self._users = MappingProxyType(users)
+        first_load = self.version is None
+        self.version = version
+        if not first_load:
+            for username in changes:
+                for listener in self._listeners:
+                    listener(username)
+        return list(changes)
+
+    async def start(self):
+        await self.refresh()
+        self._refresher = asyncio.ensure_future(self._refresh_forever())
+
+    async def stop(self):
+        if self._refresher is not None:
+            self._refresher.cancel()
+            self._refresher = None
+
+    async def _refresh_forever(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception:
+                # Keep serving the last snapshot until the backend is back.
+                pass